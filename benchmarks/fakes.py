@@ -0,0 +1,248 @@
+"""Offline stand-ins for OpenAI and Google Calendar used by the load test."""
+from autogen_core import CancellationToken, FunctionCall
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelInfo,
+    RequestUsage,
+    UserMessage,
+    FunctionExecutionResultMessage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncGenerator, Dict, List, Mapping, Sequence
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from src.tools.client_factory import ClientFactory
+from src.tools.event_cache import event_bounds, parse_datetime
+
+class FakeChatCompletionClient(ChatCompletionClient):
+    """Scripted model: for every user message it calls the tools in `tool_pattern`, one step per round-trip, then replies.
+
+    A step written as "name*3" asks for three parallel calls of the tool in one response.
+    """
+
+    def __init__(self, tool_pattern: Sequence[str] = ("fetch_events",), latency: float = 0.2, tokens_per_second: float = 200.0) -> None:
+        self._tool_pattern = list(tool_pattern)
+        self._latency = latency
+        self._tokens_per_second = tokens_per_second
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._actual_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self.calls = 0
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Any = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: CancellationToken | None = None,
+    ) -> CreateResult:
+        self.calls += 1
+        await asyncio.sleep(self._latency * random.uniform(0.8, 1.2))
+        usage = RequestUsage(prompt_tokens=self.count_tokens(messages, tools=tools), completion_tokens=20)
+        self._actual_usage = usage
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens + usage.completion_tokens,
+        )
+        step = self._step(messages)
+        if step < len(self._tool_pattern):
+            name, _, count = self._tool_pattern[step].partition("*")
+            calls = [
+                FunctionCall(id=f"call_{uuid.uuid4().hex[:12]}", name=name, arguments=json.dumps(_arguments(name)))
+                for _ in range(int(count or 1))
+            ]
+            return CreateResult(finish_reason="function_calls", content=calls, usage=usage, cached=False)
+        return CreateResult(finish_reason="stop", content="Done! Your calendar is up to date.", usage=usage, cached=False)
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Any = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: CancellationToken | None = None,
+    ) -> AsyncGenerator[str | CreateResult, None]:
+        result = await self.create(messages, tools=tools)
+        if isinstance(result.content, str):
+            for word in result.content.split(" "):
+                await asyncio.sleep(1 / self._tokens_per_second)
+                yield word + " "
+        yield result
+
+    def _step(self, messages: Sequence[LLMMessage]) -> int:
+        # Number of tool round-trips since the last user message
+        step = 0
+        for message in reversed(messages):
+            if isinstance(message, UserMessage):
+                break
+            if isinstance(message, FunctionExecutionResultMessage):
+                step += 1
+        return step
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._actual_usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return sum(len(str(message.content)) for message in messages) // 4
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return 128000 - self.count_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return {"vision": False, "function_calling": True, "json_output": False}
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return {"vision": False, "function_calling": True, "json_output": False, "family": "unknown", "structured_output": False}
+
+def _arguments(tool: str) -> Dict[str, Any]:
+    # Plausible arguments for each calendar tool, somewhere in the next week
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(hours=random.randint(1, 7 * 24))
+    end = start + timedelta(minutes=30)
+    window = lambda moment: {"dateTime": moment.isoformat(), "timeZone": "UTC"}
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if tool == "fetch_events":
+        return {"time_min": window(today), "time_max": window(today + timedelta(days=7))}
+    if tool == "find_free_slots":
+        return {"time_min": window(today), "time_max": window(today + timedelta(days=7)), "duration_minutes": 30}
+    if tool in ("add_event_to_calendar", "find_conflicts"):
+        return {"event": {"summary": "Benchmark meeting", "start": window(start), "end": window(end)}}
+    return {}
+
+class FakeHttpError(Exception):
+    def __init__(self, status: int, reason: str) -> None:
+        super().__init__(f"<HttpError {status} \"{reason}\">")
+        self.status = status
+
+class _Request:
+    def __init__(self, service: "FakeCalendarService", run: Any) -> None:
+        self._service = service
+        self.run = run
+
+    def execute(self) -> Any:
+        # Blocking, like the real googleapiclient request
+        time.sleep(self._service.latency)
+        with self._service.lock:
+            self._service.requests += 1
+            return self.run()
+
+class _BatchRequest:
+    # Same interface as googleapiclient.http.BatchHttpRequest: one round-trip, a callback per part
+    def __init__(self, service: "FakeCalendarService", callback: Any = None) -> None:
+        self._service = service
+        self._callback = callback
+        self._parts: List[Any] = []
+
+    def add(self, request: _Request, callback: Any = None, request_id: str | None = None) -> None:
+        self._parts.append((request, callback or self._callback, request_id or str(len(self._parts) + 1)))
+
+    def execute(self) -> None:
+        time.sleep(self._service.latency)
+        with self._service.lock:
+            self._service.requests += 1
+            self._service.batches += 1
+            outcomes = []
+            for request, callback, request_id in self._parts:
+                try:
+                    outcomes.append((callback, request_id, request.run(), None))
+                except FakeHttpError as e:
+                    outcomes.append((callback, request_id, None, e))
+        for callback, request_id, response, exception in outcomes:
+            if callback is not None:
+                callback(request_id, response, exception)
+
+class _Events:
+    def __init__(self, service: "FakeCalendarService") -> None:
+        self._service = service
+
+    def list(self, calendarId: str, timeMin: str, timeMax: str, **kwargs: Any) -> _Request:
+        def run() -> Dict[str, Any]:
+            start, end = parse_datetime(timeMin), parse_datetime(timeMax)
+            items = [event for event in self._service.store.values() if event_bounds(event)[0] < end and event_bounds(event)[1] > start]
+            return {"items": sorted(items, key=lambda event: event_bounds(event)[0])}
+        return _Request(self._service, run)
+
+    def insert(self, calendarId: str, body: Dict[str, Any]) -> _Request:
+        def run() -> Dict[str, Any]:
+            event = {**body, "id": uuid.uuid4().hex, "status": "confirmed", "etag": '"1"', "htmlLink": "https://calendar.local/event"}
+            self._service.store[event["id"]] = event
+            return event
+        return _Request(self._service, run)
+
+    def patch(self, calendarId: str, eventId: str, body: Dict[str, Any]) -> _Request:
+        def run() -> Dict[str, Any]:
+            if eventId not in self._service.store:
+                raise FakeHttpError(404, "Not Found")
+            self._service.store[eventId].update(body)
+            return self._service.store[eventId]
+        return _Request(self._service, run)
+
+    def delete(self, calendarId: str, eventId: str) -> _Request:
+        def run() -> str:
+            if self._service.store.pop(eventId, None) is None:
+                raise FakeHttpError(410, "Resource has been deleted")
+            return ""
+        return _Request(self._service, run)
+
+class FakeCalendarService:
+    """In-memory replacement for the googleapiclient calendar v3 service (events resource only)."""
+
+    def __init__(self, latency: float = 0.1) -> None:
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.store: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self.batches = 0
+
+    def events(self) -> _Events:
+        return _Events(self)
+
+    def new_batch_http_request(self, callback: Any = None) -> _BatchRequest:
+        return _BatchRequest(self, callback)
+
+class FakeClientFactory(ClientFactory):
+    """ClientFactory serving the fakes, with the same scheduling and completion cache in front of the model.
+
+    `install` makes it the instance `ClientFactory()` returns, before the app first asks for a client.
+    """
+
+    def __init__(self, model_client: ChatCompletionClient, calendar: FakeCalendarService) -> None:
+        super().__init__()
+        self._fake_model_client = model_client
+        self._calendar = calendar
+
+    def install(self) -> None:
+        ClientFactory.override(self)
+
+    def credentials(self) -> Any:
+        return None
+
+    def discovery_document(self) -> Dict[str, Any]:
+        return {}
+
+    def calendar_service(self) -> Any:
+        return self._calendar
+
+    def model_client(self) -> ChatCompletionClient:
+        with self._lock:
+            if self._model_client is None:
+                self._model_client = self._wrap_model_client(self._fake_model_client)
+            return self._model_client
@@ -0,0 +1,161 @@
+"""Offline load test for the websocket API.
+
+Runs the real FastAPI app in-process with a scripted model client and an
+in-memory calendar, drives concurrent `/ws/{user_id}` sessions and reports
+throughput, turn latency, database writes per turn and memory per session.
+No network access or credentials are needed.
+
+    python -m benchmarks.load_test --sessions 50 --turns 5 --tools fetch_events,add_event_to_calendar*3
+    python -m benchmarks.load_test --stream --json
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import tempfile
+import time
+import uuid
+
+# Settings are read on import, so defaults for an offline run go in first
+_workdir = tempfile.mkdtemp(prefix="calendar-bench-")
+os.environ.setdefault("MY_OPENAI_API_KEY", "offline")
+os.environ.setdefault("MY_CALENDAR_ID", "benchmark@calendar.local")
+os.environ.setdefault("MY_DATABASE_URL", f"sqlite+aiosqlite:///{Path(_workdir) / 'bench.sqlite'}")
+
+from sqlalchemy import event
+from sqlmodel import SQLModel
+import uvicorn
+import websockets
+from benchmarks.fakes import FakeCalendarService, FakeChatCompletionClient, FakeClientFactory
+from src.database.db import Database
+from src.database.models import User
+
+class DatabaseCounter:
+    # Counts write statements and commits issued through the shared engine
+    def __init__(self) -> None:
+        self.writes = 0
+        self.commits = 0
+        self.enabled = False
+
+    def install(self) -> None:
+        engine = Database().engine.sync_engine
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if self.enabled and statement.lstrip().split(" ", 1)[0].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self.writes += 1
+
+    def _on_commit(self, conn) -> None:
+        if self.enabled:
+            self.commits += 1
+
+def rss_bytes() -> int:
+    # Current resident set size, falls back to the peak where /proc is missing
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+async def create_users(count: int) -> list[uuid.UUID]:
+    async with Database().engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+    users = [User(id=uuid.uuid4(), username=f"bench-{index}", email=f"bench-{index}@calendar.local", token=None) for index in range(count)]
+    await Database().create_all(users)
+    return [user.id for user in users]
+
+async def run_session(url: str, turns: int, stream: bool, latencies: list[float]) -> None:
+    async with websockets.connect(url, max_size=None) as websocket:
+        for turn in range(turns):
+            started = time.perf_counter()
+            await websocket.send(f"Benchmark message {turn}: what does my week look like?")
+            while True:
+                reply = await websocket.recv()
+                if not stream or json.loads(reply).get("type") in ("done", "error"):
+                    break
+            latencies.append(time.perf_counter() - started)
+
+async def main(args: argparse.Namespace) -> dict:
+    model = FakeChatCompletionClient(tool_pattern=[tool for tool in args.tools.split(",") if tool], latency=args.model_latency)
+    calendar = FakeCalendarService(latency=args.calendar_latency)
+    FakeClientFactory(model, calendar).install()
+
+    # Imported after the fakes are installed so the app picks them up on start
+    from src.main import app
+
+    user_ids = await create_users(args.sessions)
+    counter = DatabaseCounter()
+    counter.install()
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    query = "?stream=true" if args.stream else ""
+    baseline_rss = rss_bytes()
+    latencies: list[float] = []
+    counter.enabled = True
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_session(f"ws://127.0.0.1:{args.port}/ws/{user_id}{query}", args.turns, args.stream, latencies)
+        for user_id in user_ids
+    ))
+    elapsed = time.perf_counter() - started
+    peak_rss = rss_bytes()
+
+    # Shutdown drains the message sink, its writes belong to the measured turns
+    server.should_exit = True
+    await serving
+    counter.enabled = False
+
+    completed = len(latencies)
+    return {
+        "sessions": args.sessions,
+        "turns": completed,
+        "stream": args.stream,
+        "tools_per_turn": len(model._tool_pattern),
+        "elapsed_seconds": round(elapsed, 3),
+        "turns_per_second": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "latency_mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "db_writes_per_turn": round(counter.writes / completed, 2) if completed else 0.0,
+        "db_commits_per_turn": round(counter.commits / completed, 2) if completed else 0.0,
+        "model_calls": model.calls,
+        "calendar_requests": calendar.requests,
+        "calendar_batches": calendar.batches,
+        "memory_per_session_kb": round(max(peak_rss - baseline_rss, 0) / args.sessions / 1024, 1),
+    }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test for the calendar assistant websocket API.")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent websocket sessions, one user each.")
+    parser.add_argument("--turns", type=int, default=5, help="Messages sent per session.")
+    parser.add_argument("--tools", default="fetch_events", help="Comma separated tool calls the fake model makes per turn, name*N for N parallel calls.")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Seconds per fake model call.")
+    parser.add_argument("--calendar-latency", type=float, default=0.1, help="Seconds per fake calendar request.")
+    parser.add_argument("--stream", action="store_true", help="Use stream mode (JSON frames).")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>24}: {value}")
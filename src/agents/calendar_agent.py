@@ -1,7 +1,11 @@
+from bisect import bisect_left
 import json
-from typing import List, Dict
+from typing import Awaitable, Callable, List, Dict
+from uuid import UUID, uuid4
 import asyncio
+import logging
 from autogen_core import (
+    AgentId,
     FunctionCall,
     MessageContext,
     RoutedAgent,
@@ -10,6 +14,7 @@ from autogen_core import (
 )
 from autogen_core.models import (
     ChatCompletionClient,
+    CreateResult,
     LLMMessage,
     SystemMessage,
     UserMessage,
@@ -18,116 +23,258 @@ from autogen_core.models import (
     FunctionExecutionResultMessage,
 )
 from autogen_core.tools import Tool
-from src.tools.messages import CustomMessage
+from src.tools.messages import CustomMessage, StreamFrame
 from src.database.models import Message, Conversation
 from src.database.repository import UserRepository, ConversationRepository, MessageRepository
+from src.database.sink import MessageSink
+from src.agents.context import ContextCache, ConversationContext
+from src.agents.compaction import ContextCompactor
+from src.agents.registry import AgentRegistry
+from src.agents.streaming import StreamHub, TOOL_PROGRESS
+from src.agents.turn_queue import TurnQueue
+from src.agents.context_providers import ContextProvider, resolve_context
+from src.config import SETTINGS
+from src.telemetry import Metrics, span
+from src.scheduler import scheduling
 
-class CalendarAssistantAgent(RoutedAgent):
-    def __init__(self, model_client: ChatCompletionClient, tool_schema: List[Tool]) -> None:
-        super().__init__("An calendar assistant agent.")
-        self._system_messages: List[LLMMessage] = [
-            SystemMessage(content="You are a helpful Google Calendar Assistant that can (using tools):\n"
-                "- Create google calendar events\n"
-                "- Delete google calendar events\n"
-                "- Fetch google calendar events and show the user\n"
-                "- Reshecdule google calendar events\n"
-                "--- Follow the Instructions below when interacting with the user:\n"
-                "1. Always get the current date, time and timezone using the appropriate tool.\n"
-                "2. If the user asks about their schedule, availability, or existing events for a date, call the appropriate tool with the timeMin and timeMax values (in ISO 8601 format)."
-                "3. When adding an event to the calendar ask them the details of the event they want to add to their calendar including the title of the event, time it starts and how long it is.\n"
-                "4. Always Show the event created to the user in readable form and ask for a confirmation of details. "
-                "Also, display the event in the required Google Calendar event JSON format.\n"
-                "5. Before adding an event to the calendar, always check the time slot in the calendar to ensure there are no conflicts."
-                "If another event exists at the same time, inform the user and ask whether to proceed.\n"
-                "6. When rescheduling events use the appropriate tool to first read and confirm the event exists. "
-                "Then ask the user for confirmation before updating it.\n"
-            )
-        ]
+logger = logging.getLogger(__name__)
+
+# Built once and shared by every agent, so the prompt prefix sent to the model is byte-for-byte identical
+SYSTEM_PROMPT = (
+    "You are a helpful Google Calendar Assistant that can (using tools):\n"
+    "- Create google calendar events\n"
+    "- Delete google calendar events\n"
+    "- Fetch google calendar events and show the user\n"
+    "- Reshecdule google calendar events\n"
+    "--- Follow the Instructions below when interacting with the user:\n"
+    "1. The current date, time and time zone are given in the last system message, use them to resolve dates like \"tomorrow\" "
+    "instead of calling a tool.\n"
+    "2. If the user asks about their schedule, availability, or existing events for a date, call the appropriate tool with the timeMin and timeMax values (in ISO 8601 format). "
+    "Use the free slots tool to answer availability questions.\n"
+    "3. When adding an event to the calendar ask them the details of the event they want to add to their calendar including the title of the event, time it starts and how long it is.\n"
+    "4. Always Show the event created to the user in readable form and ask for a confirmation of details. "
+    "Also, display the event in the required Google Calendar event JSON format.\n"
+    "5. Before adding an event to the calendar, always check the time slot for conflicts using the conflicts tool. "
+    "If another event exists at the same time, inform the user and ask whether to proceed.\n"
+    "6. When rescheduling events use the appropriate tool to first read and confirm the event exists. "
+    "Then ask the user for confirmation before updating it.\n"
+)
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+class CalendarAssistant:
+    """The calendar assistant of one conversation, handed its messages by a CalendarAssistantAgent."""
+
+    def __init__(self, agent_id: AgentId, model_client: ChatCompletionClient, tool_schema: List[Tool], context_providers: List[ContextProvider] | None = None) -> None:
+        self.id = agent_id
+        self._system_messages: List[LLMMessage] = [SYSTEM_MESSAGE]
         self._model_client = model_client
         self._tools = tool_schema
+        self._tools_by_name: Dict[str, Tool] = {tool.name: tool for tool in tool_schema}
+        # Facts resolved on every turn instead of asked for with a tool call
+        self._context_providers = context_providers or []
         self._conversations = ConversationRepository()
         self._messages = MessageRepository()
         self._users = UserRepository() 
+        self._contexts = ContextCache()
+        self._sink = MessageSink()
+        self._compactor = ContextCompactor(model_client)
+        self._registry = AgentRegistry()
+        self._streams = StreamHub()
+        self._turns = TurnQueue(coalesce=SETTINGS.turn_coalescing)
+        self._metrics = Metrics()
+        self._conversation_ids: set[UUID] = set()
 
-    @message_handler
     async def handle_user_message(self, message: CustomMessage, ctx: MessageContext) -> CustomMessage:
-        # Check if conversation already exists in the database
-        conversation = self._conversations.get(message.conversation_id)
-        if not conversation: 
-            # Store conversation data in the database
-            self._conversations.create(Conversation(id=message.conversation_id, user_id=message.user_id))
-            # Store system message in database
-            self._messages.create(Message(conversation_id=message.conversation_id, content=self._system_messages[0].content, source="system"))
+        # Keep the agent from being evicted while it handles (or waits for) the turn
+        with self._registry.in_use(self.id):
+            # One turn at a time per conversation, messages arriving meanwhile are merged into the next one
+            return await self._turns.submit(message, lambda turn_message: self._timed_turn(turn_message, ctx))
+
+    async def _timed_turn(self, message: CustomMessage, ctx: MessageContext) -> CustomMessage:
+        # Model and calendar requests of the turn count against the user's rate limits
+        with span("turn"), scheduling(user_id=message.user_id):
+            response = await self._handle_turn(message, ctx)
+        self._metrics.inc("calendar_agent_turns_total", help="Agent turns handled.")
+        return response
+
+    async def _handle_turn(self, message: CustomMessage, ctx: MessageContext) -> CustomMessage:
+        self._conversation_ids.add(message.conversation_id)
+        # Resolve the per-turn facts while the history is loaded
+        turn_facts = asyncio.create_task(resolve_context(self._context_providers, message))
+        # Get the conversation context, loading it from the database on a cache miss
+        context = self._contexts.get(message.conversation_id)
+        if context is None:
+            with span("history_load"):
+                context = await self._load_context(message)
+
+        # Every message stored while answering this one is tagged with the same turn id
+        turn_id = uuid4()
 
         # Store user message in the database
-        self._messages.create(Message(conversation_id=message.conversation_id, content=message.content, source="user"))
+        await self._persist(context, turn_id, Message(conversation_id=message.conversation_id, content=message.content, source="user"),
+            UserMessage(content=message.content, source="user"))
 
+        facts = await turn_facts
         while True:
-            # Get messages from the database to give llm context
-            messages = self._messages.get_all(message.conversation_id,)
+            # Fit the history into the model's token budget
+            messages = await self._compactor.compact(message.conversation_id, context, self._tools)
+            if facts:
+                # Last, and not persisted, so the cached prompt prefix stays the same from turn to turn
+                messages = [*messages, SystemMessage(content=facts)]
             # Run the chat completion with the tools.
-            llm_result = await self._model_client.create(
-                messages=messages,
-                tools=self._tools,
-                cancellation_token=ctx.cancellation_token,
-            )
+            with span("model_create"):
+                llm_result = await self._create(message.conversation_id, messages, ctx.cancellation_token)
+            self._record_usage(llm_result)
 
-            print(f"{'-'*80}\n{self.id.type}:\n{llm_result.content}", flush=True)
+            logger.debug("%s: %s", self.id, llm_result.content)
             # If there are no tool calls, return the result.
             if isinstance(llm_result.content, str):
                 # Save the llm's result to the database.
-                self._messages.create(Message(conversation_id=message.conversation_id, content=llm_result.content, source="assistant_message"))
+                await self._persist(context, turn_id, Message(conversation_id=message.conversation_id, content=llm_result.content, source="assistant_message"),
+                    AssistantMessage(content=llm_result.content, source="assistant_message"))
+                # Commit the whole turn at once
+                await self._sink.end_turn(message.conversation_id)
                 return CustomMessage(content=llm_result.content)
+            calls = llm_result.content
             try:
-                # Save Function call in the database
-                tool_call_request = json.dumps([ # Serialize tool call request to string
-                    {
-                        "name": call.name,
-                        "id": call.id,
-                        "arguments": call.arguments,
-                    }
-                    for call in llm_result.content
-                ])
                 # Save tool call request message in the database
-                self._messages.create(Message(conversation_id=message.conversation_id, content=tool_call_request, source="tool_call_request"))
+                await self._persist(context, turn_id, self._messages.tool_call_request_row(message.conversation_id, calls),
+                    AssistantMessage(content=calls, source="assistant_message"))
 
                 # Execute the tool calls.
                 tool_call_results = await asyncio.gather(
-                    *[self._execute_tool_call(call, ctx.cancellation_token) for call in llm_result.content]
+                    *[self._execute_tool_call(call, message.conversation_id, ctx.cancellation_token) for call in calls]
                 )
-                # Serialize tool call result to string
-                tool_call_results_serialized = json.dumps([
-                    {
-                        "name": call.name,
-                        "call_id": call.call_id,
-                        "content": call.content,
-                        "is_error": call.is_error,
-                    }
-                    for call in tool_call_results
-                ])
-
-                print(f"{'-'*80}\n{self.id.type}:\n{tool_call_results}", flush=True)
+            except BaseException as e:
+                # Answer every call, the model rejects a history with an unanswered tool call request
+                tool_call_results = [
+                    FunctionExecutionResult(call_id=call.id, content=f"The tool call did not complete: {e!r}", is_error=True, name=call.name)
+                    for call in calls
+                ]
+                await self._persist(context, turn_id, self._messages.tool_call_result_row(message.conversation_id, tool_call_results),
+                    FunctionExecutionResultMessage(content=tool_call_results))
+                await self._sink.end_turn(message.conversation_id)
+                if not isinstance(e, Exception):
+                    # Cancelled
+                    raise
+                return CustomMessage(content=str(e))
+            logger.debug("%s: %s", self.id, tool_call_results)
 
+            try:
                 # Save the function execution results in the database.
-                self._messages.create(Message(conversation_id=message.conversation_id, content=tool_call_results_serialized, source="tool_call_result"))
+                await self._persist(context, turn_id, self._messages.tool_call_result_row(message.conversation_id, tool_call_results),
+                    FunctionExecutionResultMessage(content=tool_call_results))
             except Exception as e:
-                return Message(content=str(e))   
+                await self._sink.end_turn(message.conversation_id)
+                return CustomMessage(content=str(e))
+
+    async def _load_context(self, message: CustomMessage) -> ConversationContext:
+        # Make sure rows still buffered for this conversation are visible to the queries below
+        await self._sink.flush(message.conversation_id)
+        # Check if conversation already exists in the database
+        conversation = await self._conversations.get(message.conversation_id)
+        if conversation:
+            # Cold start for an existing conversation, hydrate it from the database
+            return await self._hydrate_context(message.conversation_id, conversation)
+
+        # Store conversation data in the database (committed together with the first turn)
+        await self._sink.add(message.conversation_id, Conversation(id=message.conversation_id, user_id=message.user_id))
+        # Store system message in database
+        await self._sink.add(message.conversation_id, Message(conversation_id=message.conversation_id, content=self._system_messages[0].content, source="system", seq=0))
+        return self._contexts.put(message.conversation_id, list(self._system_messages))
+
+    async def _hydrate_context(self, conversation_id: UUID, conversation: Conversation) -> ConversationContext:
+        # Read only the newest window of messages, starting after the summarized ones when there is a summary
+        since = conversation.summary_message_count if SETTINGS.context_summarize and conversation.summary else 1
+        rows = await self._messages.get_last(conversation_id, SETTINGS.context_history_window, since=since)
+        next_seq = rows[-1].seq + 1 if rows else await self._messages.last_seq(conversation_id) + 1
+        # A full window can start in the middle of a turn, the model needs each tool result after its request
+        while rows and rows[0].source != "user":
+            rows.pop(0)
+        entries = [(row.seq, message) for row, message in zip(rows, map(self._messages.to_llm_message, rows)) if message is not None]
+        context = self._contexts.put(
+            conversation_id, [*self._system_messages, *(message for _, message in entries)], [0, *(seq for seq, _ in entries)]
+        )
+        context.next_seq = next_seq
+        context.summary = conversation.summary
+        # First message the summary doesn't cover
+        context.summary_upto = bisect_left(context.seqs, conversation.summary_message_count, lo=1)
+        return context
+
+    async def _persist(self, context: ConversationContext, turn_id: UUID, row: Message, llm_message: LLMMessage) -> None:
+        # Append the message to the in-memory context, then buffer it for the database (a failed flush keeps it buffered)
+        row.seq, row.turn_id = context.append(llm_message), turn_id
+        await self._sink.add(row.conversation_id, row)
+
+    def _record_usage(self, llm_result: CreateResult) -> None:
+        usage = llm_result.usage
+        help = "Model tokens used, by kind."
+        self._metrics.inc("calendar_agent_tokens_total", usage.prompt_tokens, help=help, kind="prompt")
+        self._metrics.inc("calendar_agent_tokens_total", usage.completion_tokens, help=help, kind="completion")
+
+    async def _create(self, conversation_id: UUID, messages: List[LLMMessage], cancellation_token: CancellationToken) -> CreateResult:
+        if not self._streams.is_open(conversation_id):
+            return await self._model_client.create(
+                messages=messages,
+                tools=self._tools,
+                cancellation_token=cancellation_token,
+            )
+        # Forward tokens to the websocket as they arrive, the stream ends with the full result
+        llm_result = None
+        async for chunk in self._model_client.create_stream(
+            messages=messages,
+            tools=self._tools,
+            cancellation_token=cancellation_token,
+        ):
+            if isinstance(chunk, CreateResult):
+                llm_result = chunk
+            elif chunk:
+                await self._streams.publish(conversation_id, StreamFrame(type="token", content=chunk))
+        if llm_result is None:
+            raise RuntimeError("The model stream ended without a final result")
+        return llm_result
 
     async def _execute_tool_call(
-        self, call: FunctionCall, cancellation_token: CancellationToken
+        self, call: FunctionCall, conversation_id: UUID, cancellation_token: CancellationToken
     ) -> FunctionExecutionResult:
         # Find the tool by name.
-        tool = next((tool for tool in self._tools if tool.name == call.name), None)
+        tool = self._tools_by_name.get(call.name)
         # Check if tool is none 
         if tool is None:
             return FunctionExecutionResult(call_id=call.id, content="Unknown tool", is_error=True, name=call.name)
 
+        await self._streams.publish(conversation_id, StreamFrame(type="tool", name=tool.name, status="started", content=TOOL_PROGRESS.get(tool.name)))
         # Run the tool and capture the result.
         try:
             arguments = json.loads(call.arguments)
-            result = await tool.run_json(arguments, cancellation_token)
+            with span("tool", tool=tool.name):
+                result = await tool.run_json(arguments, cancellation_token)
+            await self._streams.publish(conversation_id, StreamFrame(type="tool", name=tool.name, status="finished"))
             return FunctionExecutionResult(
                 call_id=call.id, content=tool.return_value_as_string(result), is_error=False, name=tool.name
             )
         except Exception as e:
-            return FunctionExecutionResult(call_id=call.id, content=str(e), is_error=True, name=tool.name)
\ No newline at end of file
+            await self._streams.publish(conversation_id, StreamFrame(type="tool", name=tool.name, status="failed"))
+            return FunctionExecutionResult(call_id=call.id, content=str(e), is_error=True, name=tool.name)
+
+    async def close(self) -> None:
+        # Called on eviction, write out whatever this agent's conversation still has buffered
+        for conversation_id in self._conversation_ids:
+            await self._sink.flush(conversation_id)
+
+class CalendarAssistantAgent(RoutedAgent):
+    """What the runtime instantiates for an agent id, forwards messages to the id's CalendarAssistant.
+
+    The runtimes have no public API to drop an agent instance, so they only
+    hold these handles. The assistants behind them live in the AgentRegistry,
+    which evicts idle ones, and `assistant` builds a new one on the next message.
+    """
+
+    def __init__(self, assistant: Callable[[AgentId], Awaitable[CalendarAssistant]]) -> None:
+        super().__init__("An calendar assistant agent.")
+        self._assistant = assistant
+
+    @message_handler
+    async def handle_user_message(self, message: CustomMessage, ctx: MessageContext) -> CustomMessage:
+        assistant = await self._assistant(self.id)
+        return await assistant.handle_user_message(message, ctx)
@@ -0,0 +1,165 @@
+from typing import Dict, List, Sequence, Tuple
+from uuid import UUID
+from autogen_core.models import (
+    ChatCompletionClient,
+    LLMMessage,
+    SystemMessage,
+    UserMessage,
+    AssistantMessage,
+    FunctionExecutionResultMessage,
+)
+from autogen_core.tools import Tool
+from src.agents.context import ConversationContext
+from src.config import SETTINGS
+from src.database.repository import ConversationRepository
+from src.database.sink import MessageSink
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation between a user and a Google Calendar assistant below. "
+    "Keep every event id, title, date, time and time zone that was mentioned, "
+    "what the user asked for and what was created, changed or deleted. Be brief."
+)
+
+def token_budget(model: str) -> int:
+    # Prompt token budget for a model, falling back to the default budget
+    return SETTINGS.context_token_budgets.get(model, SETTINGS.context_token_budget)
+
+class ContextCompactor:
+    """Fits a conversation into the model's prompt token budget.
+
+    The system message and the most recent turns are always sent verbatim.
+    Older turns get their tool request/result pairs collapsed into short notes,
+    or, with summarization enabled, are replaced by a running summary that is
+    stored on the conversation. Either way they are replaced in the context
+    too, so its size follows the budget rather than the conversation length.
+    """
+
+    def __init__(self, model_client: ChatCompletionClient) -> None:
+        self._model_client = model_client
+        self._budget = token_budget(SETTINGS.openai_model)
+        self._recent_turns = SETTINGS.context_recent_turns
+        self._summarize = SETTINGS.context_summarize
+        self._conversations = ConversationRepository()
+        self._sink = MessageSink()
+        # Prompt tokens without messages, by tool set
+        self._overheads: Dict[Tuple[str, ...], int] = {}
+
+    def count_tokens(self, messages: Sequence[LLMMessage], tools: Sequence[Tool]) -> int:
+        return self._model_client.count_tokens(messages, tools=tools)
+
+    async def compact(self, conversation_id: UUID, context: ConversationContext, tools: Sequence[Tool]) -> List[LLMMessage]:
+        # Tokens are counted once per message and summed, the prompt overhead and the tools once per agent
+        context.prompt_tokens = self._overhead(tools) + self._message_tokens(context, 0, len(context.messages))
+        if context.prompt_tokens <= self._budget:
+            if context.truncated and context.summary:
+                # The summary stands in for the messages that are not in the context
+                context.prompt_tokens += self._tokens_of(self._summary_message(context))
+                return [context.messages[0], self._summary_message(context), *context.messages[1:]]
+            return context.messages
+
+        cut = self._recent_start(context.messages)
+        if cut <= 1:
+            # Nothing old enough to compact
+            return context.messages
+
+        if self._summarize and context.summary_upto < cut:
+            await self._update_summary(conversation_id, context, cut)
+
+        if self._summarize and context.summary:
+            # Summarized messages are only kept in the database from now on
+            context.replace(1, context.summary_upto, [])
+            context.summary_upto = 1
+            summary = self._summary_message(context)
+            context.prompt_tokens = self._overhead(tools) + self._tokens_of(summary) + self._message_tokens(context, 0, len(context.messages))
+            return [context.messages[0], summary, *context.messages[1:]]
+
+        if self._summarize:
+            # No summary yet, collapse a copy so a later summary still reads the full messages
+            older = [message for message, _, _ in self._collapse_tool_calls(context, cut)]
+            compacted = [context.messages[0], *older, *context.messages[cut:]]
+            context.prompt_tokens = self.count_tokens(compacted, tools)
+            return compacted
+
+        # Collapsed for good, then the oldest messages dropped until the prompt fits
+        collapsed = self._collapse_tool_calls(context, cut)
+        context.replace(1, cut, collapsed)
+        cut = 1 + len(collapsed)
+        tokens = self._overhead(tools) + self._message_tokens(context, 0, len(context.messages))
+        dropped = 1
+        while dropped < cut and tokens > self._budget:
+            tokens -= self._message_tokens(context, dropped, dropped + 1)
+            dropped += 1
+        context.replace(1, dropped, [])
+        context.prompt_tokens = tokens
+        return context.messages
+
+    def _overhead(self, tools: Sequence[Tool]) -> int:
+        # Tokens of a prompt without messages
+        key = tuple(tool.name for tool in tools)
+        if key not in self._overheads:
+            self._overheads[key] = self.count_tokens([], tools)
+        return self._overheads[key]
+
+    def _tokens_of(self, message: LLMMessage) -> int:
+        return self.count_tokens([message], []) - self._overhead(())
+
+    def _message_tokens(self, context: ConversationContext, start: int, end: int) -> int:
+        total = 0
+        for index in range(start, end):
+            if context.tokens[index] is None:
+                context.tokens[index] = self._tokens_of(context.messages[index])
+            total += context.tokens[index]
+        return total
+
+    def _summary_message(self, context: ConversationContext) -> SystemMessage:
+        return SystemMessage(content=f"Summary of the earlier conversation:\n{context.summary}")
+
+    def _recent_start(self, messages: Sequence[LLMMessage]) -> int:
+        # Index of the user message that starts the oldest turn kept verbatim
+        turns = 0
+        for index in range(len(messages) - 1, 0, -1):
+            if isinstance(messages[index], UserMessage):
+                turns += 1
+                if turns == self._recent_turns:
+                    return index
+        return 1
+
+    def _collapse_tool_calls(self, context: ConversationContext, cut: int) -> List[Tuple[LLMMessage, int, int | None]]:
+        # (message, seq, tokens) entries for context.messages[1:cut], a note takes the seq of its result message
+        collapsed: List[Tuple[LLMMessage, int, int | None]] = []
+        for index in range(1, cut):
+            message = context.messages[index]
+            if isinstance(message, AssistantMessage) and not isinstance(message.content, str):
+                # The matching result message carries the useful part
+                continue
+            if isinstance(message, FunctionExecutionResultMessage):
+                preview = SETTINGS.context_tool_result_preview_chars
+                notes = [f"{result.name} -> {result.content[:preview]}" for result in message.content]
+                note = AssistantMessage(content="[Earlier tool calls] " + "; ".join(notes), source="assistant_message")
+                collapsed.append((note, context.seqs[index], None))
+                continue
+            collapsed.append((message, context.seqs[index], context.tokens[index]))
+        return collapsed
+
+    async def _update_summary(self, conversation_id: UUID, context: ConversationContext, cut: int) -> None:
+        transcript = []
+        if context.summary:
+            transcript.append(f"Previous summary: {context.summary}")
+        for message in context.messages[max(context.summary_upto, 1):cut]:
+            if isinstance(message, UserMessage):
+                transcript.append(f"user: {message.content}")
+            elif isinstance(message, AssistantMessage) and isinstance(message.content, str):
+                transcript.append(f"assistant: {message.content}")
+            elif isinstance(message, FunctionExecutionResultMessage):
+                transcript.extend(f"tool {result.name}: {result.content}" for result in message.content)
+        result = await self._model_client.create(
+            messages=[SystemMessage(content=SUMMARY_PROMPT), UserMessage(content="\n".join(transcript), source="user")]
+        )
+        if not isinstance(result.content, str):
+            return
+        context.summary = result.content
+        context.summary_upto = cut
+        # The conversation row may still be buffered
+        await self._sink.flush(conversation_id)
+        # Stored as a seq so a later hydration can start reading right after the summarized messages
+        await self._conversations.update_summary(conversation_id, context.summary, context.seq_of(cut))
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from typing import List, Tuple
+from uuid import UUID
+import time
+from autogen_core.models import LLMMessage
+from src.config import SETTINGS
+from src.singleton import SingletonMeta
+
+class ConversationContext:
+    """LLM messages of one conversation, kept in the same order they were persisted.
+
+    Each message keeps its seq and, once counted, its prompt tokens. Compaction
+    replaces older messages with notes or drops them for good, they stay in the
+    database.
+    """
+
+    def __init__(self, messages: List[LLMMessage], seqs: List[int] | None = None) -> None:
+        self.messages = messages
+        # Seq of each message, messages[0] is always the system message (seq 0)
+        self.seqs = seqs if seqs is not None else list(range(len(messages)))
+        # Prompt tokens of each message, None until counted
+        self.tokens: List[int | None] = [None] * len(messages)
+        self.last_used = time.monotonic()
+        # Running summary of messages[1:summary_upto], when summarization is enabled
+        self.summary: str | None = None
+        self.summary_upto = 0
+        # Prompt tokens of the last model call
+        self.prompt_tokens = 0
+        # Seq of the next persisted message
+        self.next_seq = self.seqs[-1] + 1 if self.seqs else 0
+
+    @property
+    def truncated(self) -> bool:
+        # Older messages were left in the database when the context was hydrated, or dropped by compaction
+        return self.seq_of(1) > 1
+
+    def seq_of(self, index: int) -> int:
+        return self.seqs[index] if index < len(self.seqs) else self.next_seq
+
+    def append(self, message: LLMMessage) -> int:
+        # Returns the seq the message is persisted with
+        seq = self.next_seq
+        self.next_seq += 1
+        self.messages.append(message)
+        self.seqs.append(seq)
+        self.tokens.append(None)
+        return seq
+
+    def replace(self, start: int, end: int, entries: List[Tuple[LLMMessage, int, int | None]]) -> None:
+        # Replace messages[start:end] with (message, seq, tokens) entries
+        self.messages[start:end] = [message for message, _, _ in entries]
+        self.seqs[start:end] = [seq for _, seq, _ in entries]
+        self.tokens[start:end] = [tokens for _, _, tokens in entries]
+
+class ContextCache(metaclass=SingletonMeta):
+    """Process wide LRU/TTL cache of conversation contexts.
+
+    Agents hydrate a context from the database once and then append to it as
+    messages are persisted, so the history is not re-read before every model call.
+    """
+
+    def __init__(self) -> None:
+        self._max_conversations = SETTINGS.context_cache_max_conversations
+        self._ttl = SETTINGS.context_cache_ttl_seconds
+        self._entries: OrderedDict[UUID, ConversationContext] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, conversation_id: UUID) -> bool:
+        return conversation_id in self._entries
+
+    def get(self, conversation_id: UUID) -> ConversationContext | None:
+        self._expire()
+        context = self._entries.get(conversation_id)
+        if context is None:
+            return None
+        # Mark as most recently used
+        self._entries.move_to_end(conversation_id)
+        context.last_used = time.monotonic()
+        return context
+
+    def put(self, conversation_id: UUID, messages: List[LLMMessage], seqs: List[int] | None = None) -> ConversationContext:
+        context = ConversationContext(messages, seqs)
+        self._entries[conversation_id] = context
+        self._entries.move_to_end(conversation_id)
+        # Drop least recently used conversations once the cache is full
+        while len(self._entries) > self._max_conversations:
+            self._entries.popitem(last=False)
+        return context
+
+    def evict(self, conversation_id: UUID) -> None:
+        self._entries.pop(conversation_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _expire(self) -> None:
+        # Entries are ordered by last use, so expired ones are always at the front
+        deadline = time.monotonic() - self._ttl
+        while self._entries:
+            conversation_id, context = next(iter(self._entries.items()))
+            if context.last_used >= deadline:
+                break
+            del self._entries[conversation_id]
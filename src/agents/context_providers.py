@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, tzinfo
+from typing import Awaitable, Callable, List
+import asyncio
+import logging
+from src.tools.calendar_api_client import CalendarAPIClient
+from src.tools.messages import CustomMessage, EventDateTime
+from src.tools.serializers import format_events
+from src.config import SETTINGS
+from src.telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Returns a fact for the model's context of the turn, or None when there is nothing to add
+ContextProvider = Callable[[CustomMessage], Awaitable[str | None]]
+
+def current_time(time_zone: tzinfo) -> ContextProvider:
+    async def provide(message: CustomMessage) -> str:
+        now = datetime.now(time_zone)
+        step = max(1, SETTINGS.context_time_resolution_minutes)
+        now = now.replace(minute=now.minute - now.minute % step, second=0, microsecond=0)
+        return f"Current date and time: {now.isoformat(timespec='minutes')} ({now.strftime('%A')}). Time zone: {time_zone}."
+    return provide
+
+def todays_events(client: CalendarAPIClient, time_zone: tzinfo) -> ContextProvider:
+    async def provide(message: CustomMessage) -> str:
+        start = datetime.now(time_zone).replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=1)
+        # Served from the event cache after the first turn
+        events = await client.list_events(
+            EventDateTime(dateTime=start.isoformat(), timeZone=str(time_zone)),
+            EventDateTime(dateTime=end.isoformat(), timeZone=str(time_zone)),
+        )
+        return "Today's events:\n" + format_events(events, 0, SETTINGS.fetch_events_page_size, SETTINGS.tool_result_token_budget)
+    return provide
+
+async def resolve_context(providers: List[ContextProvider], message: CustomMessage) -> str | None:
+    # Providers run concurrently, one that fails is left out rather than failing the turn
+    if not providers:
+        return None
+    with span("context"):
+        results = await asyncio.gather(*(provide(message) for provide in providers), return_exceptions=True)
+    facts = []
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.warning("Context provider failed: %r", result)
+        elif result:
+            facts.append(result)
+    return "\n".join(facts) or None
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+from autogen_core import AgentId
+import time
+from src.singleton import SingletonMeta
+
+class AgentRecord:
+    def __init__(self, agent: Any) -> None:
+        self.agent = agent
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        self.released = False
+        self.released_at = 0.0
+
+class AgentRegistry(metaclass=SingletonMeta):
+    """Bookkeeping for the agent instances living in this process.
+
+    Records are ordered by last use. The runtime manager asks for idle,
+    released or least recently used agents to evict, agents that are
+    handling a message are never returned.
+    """
+
+    def __init__(self) -> None:
+        self._agents: OrderedDict[AgentId, AgentRecord] = OrderedDict()
+        # Keys of evicted agents (bounded), used to count re-creations
+        self._evicted_keys: OrderedDict[AgentId, None] = OrderedDict()
+        self.evicted = 0
+        self.recreated = 0
+
+    @property
+    def live(self) -> int:
+        return len(self._agents)
+
+    def stats(self) -> Dict[str, int]:
+        return {"live": self.live, "evicted": self.evicted, "recreated": self.recreated}
+
+    def agent(self, agent_id: AgentId) -> Any:
+        record = self._agents.get(agent_id)
+        return record.agent if record is not None else None
+
+    def created(self, agent_id: AgentId, agent: Any) -> None:
+        if agent_id in self._evicted_keys:
+            del self._evicted_keys[agent_id]
+            self.recreated += 1
+        self._agents[agent_id] = AgentRecord(agent)
+
+    def removed(self, agent_id: AgentId) -> Any:
+        # The removed agent instance, if it was registered
+        record = self._agents.pop(agent_id, None)
+        if record is None:
+            return None
+        self.evicted += 1
+        self._evicted_keys[agent_id] = None
+        while len(self._evicted_keys) > 10_000:
+            self._evicted_keys.popitem(last=False)
+        return record.agent
+
+    def release(self, agent_id: AgentId) -> None:
+        # The client went away, the agent can go as soon as it is idle
+        record = self._agents.get(agent_id)
+        if record is not None:
+            record.released = True
+            record.released_at = time.monotonic()
+
+    def attach(self, agent_id: AgentId) -> bool:
+        # A client (re)connected, keeps a released agent alive; whether the agent is still live
+        record = self._agents.get(agent_id)
+        if record is None:
+            return False
+        record.released = False
+        record.last_used = time.monotonic()
+        self._agents.move_to_end(agent_id)
+        return True
+
+    @contextmanager
+    def in_use(self, agent_id: AgentId) -> Iterator[None]:
+        record = self._agents.get(agent_id)
+        if record is None:
+            # Instances registered outside the factory are not tracked
+            yield
+            return
+        record.in_flight += 1
+        record.released = False
+        self._agents.move_to_end(agent_id)
+        try:
+            yield
+        finally:
+            record.in_flight -= 1
+            record.last_used = time.monotonic()
+
+    def evictable(self, idle_timeout: float, max_live: int, grace: float = 0.0) -> List[AgentId]:
+        now = time.monotonic()
+        deadline, released_deadline = now - idle_timeout, now - grace
+        idle = [
+            agent_id for agent_id, record in self._agents.items()
+            if not record.in_flight and ((record.released and record.released_at <= released_deadline) or record.last_used < deadline)
+        ]
+        # Over the cap, also evict the least recently used idle agents
+        excess = self.live - len(idle) - max_live
+        if excess > 0:
+            for agent_id, record in self._agents.items():
+                if excess <= 0:
+                    break
+                if not record.in_flight and agent_id not in idle:
+                    idle.append(agent_id)
+                    excess -= 1
+        return idle
@@ -0,0 +1,54 @@
+from typing import Dict
+from uuid import UUID
+import asyncio
+from src.config import SETTINGS
+from src.tools.messages import StreamFrame
+from src.singleton import SingletonMeta
+
+# What the user sees while a tool runs
+TOOL_PROGRESS = {
+    "get_date_and_time": "Checking the date and time…",
+    "fetch_events": "Checking your calendar…",
+    "find_conflicts": "Checking for conflicts…",
+    "find_free_slots": "Looking for free time…",
+    "add_event_to_calendar": "Adding the event…",
+    "patch_event": "Updating the event…",
+    "delete_event": "Deleting the event…",
+}
+
+class StreamHub(metaclass=SingletonMeta):
+    """Bounded per-conversation frame queues between agents and websockets.
+
+    Publishing waits while a conversation's queue is full, which slows down
+    reading the model stream to the pace of the client. A client that does
+    not drain its queue within `stream_send_timeout_seconds` loses the stream
+    of the turn, the websocket sends it the final reply directly.
+    """
+
+    def __init__(self) -> None:
+        self._queues: Dict[UUID, asyncio.Queue[StreamFrame]] = {}
+
+    def open(self, conversation_id: UUID) -> asyncio.Queue[StreamFrame]:
+        queue = self._queues[conversation_id] = asyncio.Queue(maxsize=SETTINGS.stream_queue_size)
+        return queue
+
+    def close(self, conversation_id: UUID, queue: asyncio.Queue[StreamFrame] | None = None) -> None:
+        # With a queue, only closes it if a reconnected client has not replaced it in the meantime
+        if queue is None or self._queues.get(conversation_id) is queue:
+            self._queues.pop(conversation_id, None)
+
+    def is_open(self, conversation_id: UUID) -> bool:
+        return conversation_id in self._queues
+
+    async def publish(self, conversation_id: UUID, frame: StreamFrame) -> bool:
+        # Whether the frame was queued, not when the stream is closed or the client stalled
+        queue = self._queues.get(conversation_id)
+        if queue is None:
+            return False
+        try:
+            await asyncio.wait_for(queue.put(frame), SETTINGS.stream_send_timeout_seconds)
+        except asyncio.TimeoutError:
+            # Stalled client, stop streaming to it
+            self.close(conversation_id, queue)
+            return False
+        return True
@@ -0,0 +1,71 @@
+from typing import Awaitable, Callable, Dict, List, Tuple
+from uuid import UUID
+import asyncio
+from src.tools.messages import CustomMessage
+
+Turn = Callable[[CustomMessage], Awaitable[CustomMessage]]
+
+class TurnQueue:
+    """Runs at most one turn at a time per conversation.
+
+    Messages that arrive while a turn is in flight wait for it to finish. With
+    coalescing they are then merged into a single next turn and every sender
+    gets that turn's reply, otherwise they run one after another in order.
+    """
+
+    def __init__(self, coalesce: bool) -> None:
+        self._coalesce = coalesce
+        # Each message keeps the turn callable of its sender (its message context and cancellation token)
+        self._pending: Dict[UUID, List[Tuple[CustomMessage, Turn, asyncio.Future]]] = {}
+        self._drivers: Dict[UUID, asyncio.Task] = {}
+
+    def in_flight(self, conversation_id: UUID) -> bool:
+        return conversation_id in self._drivers
+
+    async def submit(self, message: CustomMessage, run: Turn) -> CustomMessage:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(message.conversation_id, []).append((message, run, future))
+        if message.conversation_id not in self._drivers:
+            # A separate task drives the queue so a cancelled sender doesn't strand the others
+            self._drivers[message.conversation_id] = asyncio.create_task(self._drive(message.conversation_id))
+        return await asyncio.shield(future)
+
+    async def _drive(self, conversation_id: UUID) -> None:
+        try:
+            while self._pending.get(conversation_id):
+                pending = self._pending[conversation_id]
+                batch = pending[:] if self._coalesce else pending[:1]
+                del pending[:len(batch)]
+                # A merged turn runs in the context of its newest sender
+                _, run, _ = batch[-1]
+                try:
+                    response = await run(self._merge([message for message, _, _ in batch]))
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                except BaseException as e:
+                    for _, _, future in batch:
+                        future.cancel()
+                    # A turn cancelled through its sender's token doesn't stop the others, cancelling the driver does
+                    if not isinstance(e, asyncio.CancelledError) or asyncio.current_task().cancelling():
+                        raise
+                    continue
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result(response)
+        finally:
+            # Never leave a sender waiting on a driver that is gone
+            for _, _, future in self._pending.pop(conversation_id, []):
+                future.cancel()
+            self._drivers.pop(conversation_id, None)
+
+    def _merge(self, messages: List[CustomMessage]) -> CustomMessage:
+        if len(messages) == 1:
+            return messages[0]
+        return CustomMessage(
+            user_id=messages[0].user_id,
+            conversation_id=messages[0].conversation_id,
+            content="\n".join(message.content for message in messages),
+        )
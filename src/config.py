@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List, Literal
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -7,8 +8,120 @@ load_dotenv()
 class Settings(BaseSettings):
     openai_api_key: str
     calendar_id: str
+    openai_model: str = "gpt-4o-mini"
+    # Worker threads available for concurrent Google Calendar API calls
+    calendar_max_workers: int = 16
+    # How long listed calendar events may be served from the local cache
+    event_cache_ttl_seconds: float = 300.0
+    # Days of events loaded into the cache when a websocket connects, 0 disables the prefetch
+    calendar_prefetch_days: int = 7
+    # Calendar changes started within this window (e.g. the tool calls of one model response) go out as one batch request
+    calendar_batch_window_seconds: float = 0.005
+    # Size limits for tool results sent back to the model
+    tool_result_token_budget: int = 600
+    fetch_events_page_size: int = 50
+    # Conflict and free slot checks
+    working_hours_start: str = "09:00"
+    working_hours_end: str = "17:00"
+    working_days: List[int] = [0, 1, 2, 3, 4] # Monday is 0
+    recurrence_horizon_days: int = 90
+    recurrence_max_occurrences: int = 100
+
+    # Database (use sqlite+aiosqlite locally, postgresql+asyncpg in production)
+    database_url: str = "sqlite+aiosqlite:///src/database/db.sqlite"
+    database_echo: bool = False
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30.0
+    database_pool_recycle: int = 1800
+
+    # Agent runtime ("local" runs everything in-process, "grpc" shards agents over worker processes)
+    runtime_mode: Literal["local", "grpc"] = "local"
+    runtime_host_address: str = "localhost:50051"
+    runtime_embedded_host: bool = False
+    runtime_shard_count: int = 1
+    # Shards owned by this process, required in grpc mode unless the host is embedded ([] to only serve websockets).
+    # A shard is registered by one process only, so set it per process (not with uvicorn --workers).
+    runtime_shard_indexes: List[int] | None = None
+
+    # Agent instance lifecycle
+    agent_idle_timeout_seconds: float = 900.0
+    agent_max_live: int = 1000
+    agent_sweep_interval_seconds: float = 30.0
+    # How long the agent of a disconnected websocket is kept for the client to reconnect
+    agent_resume_grace_seconds: float = 60.0
+
+    # Resume tokens handed to websocket clients, random per process when no secret is set (tokens then die with the process).
+    # Required in grpc mode and with several web workers (WEB_CONCURRENCY), startup fails without it
+    resume_secret: str = ""
+    resume_token_ttl_seconds: float = 86400.0
+
+    # Merge messages that arrive while a conversation's turn is running into the next turn
+    turn_coalescing: bool = True
+
+    # Request scheduler, token buckets (requests per second) per backend for the whole process and for each user
+    scheduler_rates: Dict[str, float] = {"openai": 50.0, "calendar": 20.0}
+    scheduler_user_rates: Dict[str, float] = {"openai": 5.0, "calendar": 5.0}
+    scheduler_burst: int = 10
+    scheduler_max_tracked_users: int = 10000
+    # Concurrency limit per backend, halved on rate limit errors and grown back on success
+    scheduler_max_concurrency: Dict[str, int] = {"openai": 32, "calendar": 16}
+    scheduler_max_retries: int = 4
+    scheduler_backoff_base_seconds: float = 0.5
+    scheduler_backoff_max_seconds: float = 20.0
+
+    # Completion cache in front of the model: "off", "memory" or "disk" (sqlite file at completion_cache_path)
+    completion_cache: Literal["off", "memory", "disk"] = "off"
+    completion_cache_path: str = "src/database/completion_cache.sqlite"
+    completion_cache_ttl_seconds: float = 3600.0
+    completion_cache_max_entries: int = 4096
+
+    # Add today's events to the context of every turn, next to the current date and time
+    context_todays_events: bool = False
+    # The current time given to the model is rounded down to this many minutes, so identical turns within that step send
+    # identical prompts and can be served by the completion cache. It bounds how old a cached answer's "now" can be
+    context_time_resolution_minutes: int = 5
+
+    # In-memory conversation context cache
+    context_cache_max_conversations: int = 1024
+    context_cache_ttl_seconds: float = 1800.0
+    # Most messages read back from the database when a conversation is hydrated
+    context_history_window: int = 200
+
+    # Prompt token budgets per model, recent turns kept verbatim when compacting
+    context_token_budget: int = 16000
+    context_token_budgets: Dict[str, int] = {"gpt-4o-mini": 32000}
+    context_recent_turns: int = 4
+    context_summarize: bool = False
+    context_tool_result_preview_chars: int = 200
+
+    # Websocket streaming
+    stream_queue_size: int = 256
+    stream_send_timeout_seconds: float = 10.0
+
+    # Export OpenTelemetry spans for the agent loop (needs opentelemetry installed and configured)
+    otel_enabled: bool = False
+
+    # Retention worker, runs when any policy is set (on one process only when several share the database), 0 disables a policy.
+    # Conversations written to within context_cache_ttl_seconds (or agent_idle_timeout_seconds) are never deleted, as an
+    # agent of any process may still hold them
+    retention_max_age_days: float = 0
+    retention_max_conversations_per_user: int = 0
+    retention_max_messages_per_conversation: int = 0
+    retention_interval_seconds: float = 3600.0
+    retention_batch_size: int = 500
+    # Pruned rows are written here as zstd (when zstandard is installed) or gzip compressed JSONL, nothing is archived when empty.
+    # Keep it outside the source tree, e.g. /var/lib/calendar-agent/archive
+    retention_archive_dir: str = ""
+    # Free pages given back to the file system per run (sqlite incremental vacuum), 0 gives back all of them
+    retention_vacuum_pages: int = 0
+
+    # Write-behind message persistence ("flush_before_reply" or "async")
+    message_sink_durability: Literal["flush_before_reply", "async"] = "flush_before_reply"
+    message_sink_max_buffered: int = 64
+    message_sink_flush_interval_seconds: float = 1.0
 
     model_config = SettingsConfigDict(env_prefix="MY_")
 
 
-SETTINGS = Settings()
\ No newline at end of file
+SETTINGS = Settings()
@@ -1,50 +1,74 @@
-from sqlmodel import create_engine, Session
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.sql.selectable import Select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Any
+from src.config import SETTINGS
+from src.singleton import SingletonMeta
 
-# TODO: make this url an environment variable 
-DATABASE_URL = "sqlite:///src/database/db.sqlite"
-        
-class DatabaseMeta(type):
-    _instances = {}
-
-    def __call__(cls, *args, **kwargs):
-        """
-        Possible changes to the value of the `__init__` argument do not affect
-        the returned instance.
-        """
-        if cls not in cls._instances:
-            instance = super().__call__(*args, **kwargs)
-            cls._instances[cls] = instance
-        return cls._instances[cls]
-
-class Database(metaclass=DatabaseMeta):
+def _engine_options(database_url: str) -> dict[str, Any]:
+    options: dict[str, Any] = {"echo": SETTINGS.database_echo, "pool_pre_ping": True}
+    url = make_url(database_url)
+    # In-memory sqlite databases live on a single connection, so there is no pool to size.
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        pool_size=SETTINGS.database_pool_size,
+        max_overflow=SETTINGS.database_max_overflow,
+        pool_timeout=SETTINGS.database_pool_timeout,
+        pool_recycle=SETTINGS.database_pool_recycle,
+    )
+    return options
+
+class Database(metaclass=SingletonMeta):
     def __init__(self) -> None:
-        self._engine = create_engine(DATABASE_URL, echo=False)
-    
-    def create(self, data: Any):
-        with Session(self._engine) as session:
+        self._engine = create_async_engine(SETTINGS.database_url, **_engine_options(SETTINGS.database_url))
+
+    @property
+    def engine(self):
+        return self._engine
+
+    def session(self) -> AsyncSession:
+        # Keep loaded objects usable after commit, the session is closed right after.
+        return AsyncSession(self._engine, expire_on_commit=False)
+
+    async def create(self, data: Any):
+        async with self.session() as session:
             session.add(data)
-            session.commit()
+            await session.commit()
+
+    async def create_all(self, data: list[Any], statements: list[Any] | None = None):
+        # Write all rows, then run the statements, in a single transaction
+        async with self.session() as session:
+            session.add_all(data)
+            for statement in statements or []:
+                await session.exec(statement)
+            await session.commit()
 
-    def get(self, statement: Select) -> Any:
-        with Session(self._engine) as session:
-            results = session.exec(statement)
+    async def get(self, statement: Select) -> Any:
+        async with self.session() as session:
+            results = await session.exec(statement)
             result = results.first()
             return result
 
-    def get_all(self, statement: Select) -> Any:
-        with Session(self._engine) as session:
-            results = session.exec(statement)
-            return results        
+    async def get_all(self, statement: Select) -> Any:
+        async with self.session() as session:
+            results = await session.exec(statement)
+            return results.all()
 
-    def update(self, id: str, stat: Any):
-        pass
+    async def update(self, statement: Any):
+        async with self.session() as session:
+            await session.exec(statement)
+            await session.commit()
 
-    def delete(self, statement: Select):
-        with Session(self._engine) as session:
-            results = session.exec(statement)
+    async def delete(self, statement: Select):
+        async with self.session() as session:
+            results = await session.exec(statement)
             result = results.one() # Ensure that there's exactly one row matching the query
 
-            session.delete(result)
-            session.commit()
\ No newline at end of file
+            await session.delete(result)
+            await session.commit()
+
+    async def dispose(self) -> None:
+        # Close all pooled connections.
+        await self._engine.dispose()
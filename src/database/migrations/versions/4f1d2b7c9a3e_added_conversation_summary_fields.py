@@ -0,0 +1,32 @@
+"""Added summary fields to the Conversation model
+
+Revision ID: 4f1d2b7c9a3e
+Revises: 8683dc23de22
+Create Date: 2026-10-18 10:12:31.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f1d2b7c9a3e'
+down_revision: Union[str, Sequence[str], None] = '8683dc23de22'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversation', sa.Column('summary', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('conversation', sa.Column('summary_message_count', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('conversation') as batch_op:
+        batch_op.drop_column('summary_message_count')
+        batch_op.drop_column('summary')
@@ -0,0 +1,46 @@
+"""Added ordering and turn fields to the Message model
+
+Revision ID: 9b3e6c1d2f40
+Revises: 4f1d2b7c9a3e
+Create Date: 2026-10-18 14:02:47.903114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e6c1d2f40'
+down_revision: Union[str, Sequence[str], None] = '4f1d2b7c9a3e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('message', sa.Column('seq', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('message', sa.Column('created_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('message', sa.Column('turn_id', sa.Uuid(), nullable=True))
+    # Existing rows were written in id order, number them per conversation starting at 0 in a single pass
+    # (UPDATE ... FROM needs sqlite 3.33 or later)
+    op.execute(
+        "UPDATE message SET seq = numbered.seq FROM ("
+        "SELECT id, ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY id) - 1 AS seq FROM message"
+        ") AS numbered WHERE numbered.id = message.id"
+    )
+    op.execute("UPDATE message SET created_at = CURRENT_TIMESTAMP")
+    with op.batch_alter_table('message') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+    op.create_index('ix_message_conversation_id_seq', 'message', ['conversation_id', 'seq'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_conversation_id_seq', table_name='message')
+    with op.batch_alter_table('message') as batch_op:
+        batch_op.drop_column('turn_id')
+        batch_op.drop_column('created_at')
+        batch_op.drop_column('seq')
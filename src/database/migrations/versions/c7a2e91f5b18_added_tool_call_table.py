@@ -0,0 +1,84 @@
+"""Added the ToolCall model
+
+Revision ID: c7a2e91f5b18
+Revises: 9b3e6c1d2f40
+Create Date: 2026-10-18 16:27:05.216843
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import json
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a2e91f5b18'
+down_revision: Union[str, Sequence[str], None] = '9b3e6c1d2f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tool_call = op.create_table('tool_call',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('call_id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('arguments', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('content', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('is_error', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['message_id'], ['message.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tool_call_message_id'), 'tool_call', ['message_id'], unique=False)
+
+    # Move the JSON encoded tool calls out of message.content
+    connection = op.get_bind()
+    message = sa.table('message', sa.column('id', sa.Integer()), sa.column('source', sa.String()), sa.column('content', sa.String()))
+    rows = connection.execute(
+        sa.select(message.c.id, message.c.source, message.c.content)
+        .where(message.c.source.in_(['tool_call_request', 'tool_call_result']))
+    ).all()
+    tool_calls = []
+    for message_id, source, content in rows:
+        for position, call in enumerate(json.loads(content)):
+            if source == 'tool_call_request':
+                tool_calls.append({'message_id': message_id, 'position': position, 'call_id': call['id'], 'name': call['name'],
+                    'arguments': call['arguments'], 'content': None, 'is_error': None})
+            else:
+                tool_calls.append({'message_id': message_id, 'position': position, 'call_id': call['call_id'], 'name': call['name'],
+                    'arguments': None, 'content': call['content'], 'is_error': call['is_error']})
+    if tool_calls:
+        op.bulk_insert(tool_call, tool_calls)
+    connection.execute(
+        message.update().where(message.c.source.in_(['tool_call_request', 'tool_call_result'])).values(content='')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Put the tool calls back into message.content as JSON
+    connection = op.get_bind()
+    message = sa.table('message', sa.column('id', sa.Integer()), sa.column('source', sa.String()), sa.column('content', sa.String()))
+    tool_call = sa.table('tool_call', sa.column('message_id', sa.Integer()), sa.column('position', sa.Integer()),
+        sa.column('call_id', sa.String()), sa.column('name', sa.String()), sa.column('arguments', sa.String()),
+        sa.column('content', sa.String()), sa.column('is_error', sa.Boolean()))
+    rows = connection.execute(
+        sa.select(message.c.id, message.c.source, tool_call.c.call_id, tool_call.c.name, tool_call.c.arguments, tool_call.c.content, tool_call.c.is_error)
+        .join(tool_call, tool_call.c.message_id == message.c.id)
+        .order_by(message.c.id, tool_call.c.position)
+    ).all()
+    contents: dict[int, list] = {}
+    for message_id, source, call_id, name, arguments, content, is_error in rows:
+        if source == 'tool_call_request':
+            contents.setdefault(message_id, []).append({'name': name, 'id': call_id, 'arguments': arguments})
+        else:
+            contents.setdefault(message_id, []).append({'name': name, 'call_id': call_id, 'content': content, 'is_error': is_error})
+    for message_id, calls in contents.items():
+        connection.execute(message.update().where(message.c.id == message_id).values(content=json.dumps(calls)))
+    op.drop_index(op.f('ix_tool_call_message_id'), table_name='tool_call')
+    op.drop_table('tool_call')
@@ -0,0 +1,30 @@
+"""Added timezone field to the User model
+
+Revision ID: d4e8f2a6b913
+Revises: c7a2e91f5b18
+Create Date: 2026-10-18 18:41:19.557302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4e8f2a6b913'
+down_revision: Union[str, Sequence[str], None] = 'c7a2e91f5b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('user', sa.Column('timezone', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('timezone')
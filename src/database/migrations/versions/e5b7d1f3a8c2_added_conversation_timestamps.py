@@ -0,0 +1,47 @@
+"""Added timestamps to the Conversation model
+
+Revision ID: e5b7d1f3a8c2
+Revises: d4e8f2a6b913
+Create Date: 2026-10-18 20:12:05.318426
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b7d1f3a8c2'
+down_revision: Union[str, Sequence[str], None] = 'd4e8f2a6b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversation', sa.Column('created_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('conversation', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+    # Existing conversations span their first to last message
+    op.execute(
+        "UPDATE conversation SET "
+        "created_at = (SELECT MIN(created_at) FROM message WHERE message.conversation_id = conversation.id), "
+        "updated_at = (SELECT MAX(created_at) FROM message WHERE message.conversation_id = conversation.id)"
+    )
+    op.execute("UPDATE conversation SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    op.execute("UPDATE conversation SET updated_at = created_at WHERE updated_at IS NULL")
+    with op.batch_alter_table('conversation') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+    op.create_index('ix_conversation_updated_at', 'conversation', ['updated_at'])
+    op.create_index('ix_conversation_user_id', 'conversation', ['user_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversation_user_id', table_name='conversation')
+    op.drop_index('ix_conversation_updated_at', table_name='conversation')
+    with op.batch_alter_table('conversation') as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('created_at')
@@ -1,4 +1,6 @@
-from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import DateTime
+from sqlmodel import SQLModel, Field, Relationship, Index
+from datetime import datetime, timezone
 import uuid
 
 class User(SQLModel, table=True):
@@ -6,17 +8,53 @@ class User(SQLModel, table=True):
     username: str
     email: str
     token: str | None
+    # IANA time zone name, the server's local zone is used when unset
+    timezone: str | None = None
 
 class MessageBase(SQLModel):
     conversation_id: uuid.UUID = Field(foreign_key="conversation.id")
     content: str
     source: str
+    # Position within the conversation, the system message is 0
+    seq: int = Field(default=0)
+    # Aware UTC values need a time zone aware column on Postgres
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=DateTime(timezone=True))
+    # Shared by the user message and everything the agent stored while answering it
+    turn_id: uuid.UUID | None = Field(default=None)
 
 class Message(MessageBase, table=True):
+    # History reads are keyset scans over (conversation_id, seq)
+    __table_args__ = (Index("ix_message_conversation_id_seq", "conversation_id", "seq"),)
+
     id: int = Field(default=None, primary_key=True)    
     conversation: "Conversation" = Relationship(back_populates="messages")
+    # Calls of a tool_call_request row, or results of a tool_call_result row
+    tool_calls: list["ToolCall"] = Relationship(
+        back_populates="message",
+        sa_relationship_kwargs={"lazy": "selectin", "order_by": "ToolCall.position", "cascade": "all, delete-orphan"},
+    )
+
+class ToolCall(SQLModel, table=True):
+    __tablename__ = "tool_call"
+
+    id: int = Field(default=None, primary_key=True)
+    message_id: int = Field(foreign_key="message.id", index=True, ondelete="CASCADE")
+    position: int
+    call_id: str
+    name: str
+    # Argument JSON exactly as the model produced it, only set on requests
+    arguments: str | None = None
+    # Only set on results
+    content: str | None = None
+    is_error: bool | None = None
+    message: Message = Relationship(back_populates="tool_calls")
     
 class Conversation(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
-    user_id: uuid.UUID = Field(foreign_key="user.id")
+    user_id: uuid.UUID = Field(foreign_key="user.id", index=True)
+    summary: str | None = None
+    summary_message_count: int = Field(default=0)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=DateTime(timezone=True))
+    # Last time messages were written, read by the retention policies
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True, sa_type=DateTime(timezone=True))
     messages: list[Message] = Relationship(back_populates="conversation")
\ No newline at end of file
@@ -1,5 +1,5 @@
-from sqlmodel import select
-from src.database.models import User, Conversation, Message
+from sqlmodel import select, update, func
+from src.database.models import User, Conversation, Message, ToolCall
 from autogen_core.models import (
     LLMMessage,
     SystemMessage,
@@ -17,71 +17,125 @@ class UserRepository:
     def __init__(self):
         self.database = Database()
 
-    def create(self, user: User) -> str:
-        self.database.create(user)
+    async def create(self, user: User) -> str:
+        await self.database.create(user)
 
-    def get(self, id: str) -> User:
+    async def get(self, id: str) -> User:
         # Fetch User data from database
         statement = select(User).where(User.id == UUID(id))
-        user = self.database.get(statement)
+        user = await self.database.get(statement)
         return user
 
-    def delete(self, id: str):
+    async def delete(self, id: str):
         statement = select(User).where(User.id == UUID(id))
-        self.database.delete(statement)
+        await self.database.delete(statement)
    
 
 class ConversationRepository:
     def __init__(self):
         self.database = Database()
 
-    def create(self, conversation: Conversation) -> str:
-        self.database.create(conversation)
+    async def create(self, conversation: Conversation) -> str:
+        await self.database.create(conversation)
 
-    def get(self, id: UUID) -> Conversation:
+    async def get(self, id: UUID) -> Conversation:
         # Fetch conversation data from database
         statement = select(Conversation).where(Conversation.id == id)
-        user = self.database.get(statement)
+        user = await self.database.get(statement)
         return user
 
-    def delete(self, id: UUID):
+    async def update_summary(self, id: UUID, summary: str | None, message_count: int):
+        statement = update(Conversation).where(Conversation.id == id).values(summary=summary, summary_message_count=message_count)
+        await self.database.update(statement)
+
+    async def delete(self, id: UUID):
         statement = select(Conversation).where(Conversation.id == id)
-        self.database.delete(statement)
+        await self.database.delete(statement)
 
 class MessageRepository:
     def __init__(self):
         self.database = Database()
 
-    def create(self, message: Message) -> str:
-        self.database.create(message)
+    async def create(self, message: Message) -> str:
+        await self.database.create(message)
 
-    def get_all(self, conversation_id: UUID) -> list[LLMMessage]:
+    async def get_all(self, conversation_id: UUID) -> list[LLMMessage]:
         # Fetch conversation messages from database
-        statement = select(Message.source, Message.content).where(Message.conversation_id == conversation_id)
-        results = self.database.get_all(statement)
-
-        # Construct message list
-        messages_list = []
-        for source, content in results:
-            if source == 'user':
-                messages_list.append(UserMessage(content=content, source='user'))
-            elif source == 'assistant':
-                messages_list.append(AssistantMessage(content=content, source='assistant_message'))
-            elif source == 'tool_call_request':
-                # Deserialize string back to list of python dictionaries 
-                tool_call_request_dict = json.loads(content)
-                tool_call_request_obj = [
-                    FunctionCall(id=call["id"], arguments=call["arguments"], name=call["name"]) for call in tool_call_request_dict
-                ]
-                messages_list.append(AssistantMessage(content=tool_call_request_obj, source='assistant_message'))    
-            elif source == 'tool_call_result':
-                # Deserialize string back to list of python dictionaries 
-                tool_call_results_dict = json.loads(content)
-                tool_call_results_obj = [
-                    FunctionExecutionResult(call_id=call["call_id"], content=call["content"], is_error=call["is_error"], name=call["name"]) for call in tool_call_results_dict
-                ]
-                messages_list.append(FunctionExecutionResultMessage(content=tool_call_results_obj))
-            elif source == 'system':
-                messages_list.append(SystemMessage(content=content))
-        return messages_list
+        statement = select(Message).where(Message.conversation_id == conversation_id).order_by(Message.seq, Message.id)
+        results = await self.database.get_all(statement)
+        return [message for message in map(self.to_llm_message, results) if message is not None]
+
+    async def get_last(self, conversation_id: UUID, limit: int, since: int = 0) -> list[Message]:
+        # Newest `limit` rows with seq >= since, returned oldest first
+        statement = (
+            select(Message)
+            .where(Message.conversation_id == conversation_id, Message.seq >= since)
+            .order_by(Message.seq.desc(), Message.id.desc())
+            .limit(limit)
+        )
+        results = await self.database.get_all(statement)
+        return list(reversed(results))
+
+    async def get_since(self, conversation_id: UUID, seq: int, limit: int | None = None) -> list[Message]:
+        # Rows after `seq`, pass the last seq of a page to read the next one
+        statement = (
+            select(Message)
+            .where(Message.conversation_id == conversation_id, Message.seq > seq)
+            .order_by(Message.seq, Message.id)
+        )
+        if limit is not None:
+            statement = statement.limit(limit)
+        return list(await self.database.get_all(statement))
+
+    async def last_seq(self, conversation_id: UUID) -> int:
+        # -1 when the conversation has no messages yet
+        statement = select(func.max(Message.seq)).where(Message.conversation_id == conversation_id)
+        result = await self.database.get(statement)
+        return -1 if result is None else result
+
+    @staticmethod
+    def to_llm_message(row: Message) -> LLMMessage | None:
+        source, content = row.source, row.content
+        if source == 'user':
+            return UserMessage(content=content, source='user')
+        elif source in ('assistant', 'assistant_message'):
+            return AssistantMessage(content=content, source='assistant_message')
+        elif source == 'tool_call_request':
+            if not row.tool_calls and content:
+                return AssistantMessage(content=_legacy_tool_call_request(content), source='assistant_message')
+            # Arguments stay the raw JSON string the model produced, they are only decoded when the tool runs
+            return AssistantMessage(content=[
+                FunctionCall(id=call.call_id, arguments=call.arguments, name=call.name) for call in row.tool_calls
+            ], source='assistant_message')
+        elif source == 'tool_call_result':
+            if not row.tool_calls and content:
+                return FunctionExecutionResultMessage(content=_legacy_tool_call_result(content))
+            return FunctionExecutionResultMessage(content=[
+                FunctionExecutionResult(call_id=call.call_id, content=call.content, is_error=call.is_error, name=call.name) for call in row.tool_calls
+            ])
+        elif source == 'system':
+            return SystemMessage(content=content)
+        return None
+
+    @staticmethod
+    def tool_call_request_row(conversation_id: UUID, calls: list[FunctionCall]) -> Message:
+        return Message(conversation_id=conversation_id, content="", source="tool_call_request", tool_calls=[
+            ToolCall(position=position, call_id=call.id, name=call.name, arguments=call.arguments) for position, call in enumerate(calls)
+        ])
+
+    @staticmethod
+    def tool_call_result_row(conversation_id: UUID, results: list[FunctionExecutionResult]) -> Message:
+        return Message(conversation_id=conversation_id, content="", source="tool_call_result", tool_calls=[
+            ToolCall(position=position, call_id=result.call_id, name=result.name, content=result.content, is_error=result.is_error)
+            for position, result in enumerate(results)
+        ])
+
+def _legacy_tool_call_request(content: str) -> list[FunctionCall]:
+    # Rows written before tool calls had their own table keep them as JSON in content
+    return [FunctionCall(id=call["id"], arguments=call["arguments"], name=call["name"]) for call in json.loads(content)]
 
+def _legacy_tool_call_result(content: str) -> list[FunctionExecutionResult]:
+    return [
+        FunctionExecutionResult(call_id=call["call_id"], content=call["content"], is_error=call["is_error"], name=call["name"])
+        for call in json.loads(content)
+    ]
@@ -0,0 +1,248 @@
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from pathlib import Path
+from sqlalchemy import and_, func
+from sqlmodel import delete, select
+from typing import Any, Dict, List
+from uuid import UUID
+import asyncio
+import gzip
+import json
+import logging
+from src.config import SETTINGS
+from src.agents.context import ContextCache
+from src.database.db import Database
+from src.database.models import Conversation, Message, ToolCall
+from src.database.sink import MessageSink
+from src.telemetry import Metrics, span
+from src.singleton import SingletonMeta
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+class _Archive:
+    # One file per day, appended to as compressed frames (or gzip members) that decompress as one JSONL stream
+    def __init__(self, directory: str) -> None:
+        self._directory = Path(directory)
+        self._writer: Any = None
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        if self._writer is None:
+            self._open()
+        self._writer.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode())
+        # Out of the process before the rows are deleted
+        self._writer.flush()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _open(self) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        name = f"retention-{datetime.now(timezone.utc):%Y%m%d}.jsonl"
+        if zstandard is not None:
+            self._writer = zstandard.ZstdCompressor().stream_writer(open(self._directory / f"{name}.zst", "ab"))
+        else:
+            self._writer = gzip.open(self._directory / f"{name}.gz", "ab")
+
+def _active(conversation_id: UUID) -> bool:
+    # In use by an agent of this process or not fully written yet
+    return conversation_id in ContextCache() or MessageSink().pending(conversation_id) > 0
+
+def _idle() -> Any:
+    # Agents of any process may still hold a conversation written to within their cache TTL or idle timeout
+    window = max(SETTINGS.context_cache_ttl_seconds, SETTINGS.agent_idle_timeout_seconds)
+    return Conversation.updated_at < datetime.now(timezone.utc) - timedelta(seconds=window)
+
+def _message_record(message: Message) -> Dict[str, Any]:
+    record = message.model_dump(mode="json")
+    record["tool_calls"] = [call.model_dump(mode="json", exclude={"message_id"}) for call in message.tool_calls]
+    return record
+
+class RetentionWorker(metaclass=SingletonMeta):
+    """Applies the retention policies to the conversation tables.
+
+    Every `retention_interval_seconds` it deletes conversations inactive for
+    longer than `retention_max_age_days` or older than the newest
+    `retention_max_conversations_per_user` of their user, and the oldest
+    messages of conversations longer than `retention_max_messages_per_conversation`.
+    Rows are archived before they are deleted in batches, then freed pages are
+    given back to the file system and the planner statistics refreshed.
+    Conversations written to recently enough to be cached by an agent of any
+    process are left alone, a condition checked again in the delete transaction.
+    """
+
+    def __init__(self) -> None:
+        self.database = Database()
+        self._metrics = Metrics()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(SETTINGS.retention_max_age_days or SETTINGS.retention_max_conversations_per_user
+            or SETTINGS.retention_max_messages_per_conversation)
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def run_once(self) -> Dict[str, int]:
+        report = {"conversations": 0, "messages": 0, "tool_calls": 0, "bytes": 0}
+        archive = _Archive(SETTINGS.retention_archive_dir) if SETTINGS.retention_archive_dir else None
+        with span("retention"):
+            size = await self._database_size()
+            try:
+                if SETTINGS.retention_max_age_days:
+                    cutoff = datetime.now(timezone.utc) - timedelta(days=SETTINGS.retention_max_age_days)
+                    await self._prune_conversations(Conversation.updated_at < cutoff, "max_age", archive, report)
+                if SETTINGS.retention_max_conversations_per_user:
+                    rank = func.row_number().over(
+                        partition_by=Conversation.user_id, order_by=(Conversation.updated_at.desc(), Conversation.id.desc())
+                    ).label("rank")
+                    ranked = select(Conversation.id, rank).subquery()
+                    beyond = select(ranked.c.id).where(ranked.c.rank > SETTINGS.retention_max_conversations_per_user)
+                    await self._prune_conversations(Conversation.id.in_(beyond), "max_conversations", archive, report)
+                if SETTINGS.retention_max_messages_per_conversation:
+                    await self._trim_messages(archive, report)
+            finally:
+                if archive is not None:
+                    archive.close()
+            if report["conversations"] or report["messages"]:
+                await self._compact()
+                report["bytes"] = max(0, size - await self._database_size())
+
+        for table in ("conversations", "messages", "tool_calls"):
+            self._metrics.inc("calendar_agent_retention_rows_total", report[table], help="Rows deleted by the retention worker, by table.", table=table)
+        self._metrics.inc("calendar_agent_retention_reclaimed_bytes_total", report["bytes"], help="Database bytes given back after retention runs.")
+        logger.info(
+            "Retention deleted %d conversations, %d messages and %d tool calls, reclaimed %d bytes",
+            report["conversations"], report["messages"], report["tool_calls"], report["bytes"],
+        )
+        return report
+
+    async def _run_periodically(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Retention run failed")
+            await asyncio.sleep(SETTINGS.retention_interval_seconds)
+
+    async def _prune_conversations(self, condition: Any, reason: str, archive: _Archive | None, report: Dict[str, int]) -> None:
+        # Keyset pages over the conversation id, skipped active conversations are not seen again
+        condition = and_(condition, _idle())
+        last = None
+        while True:
+            statement = select(Conversation.id).where(condition).order_by(Conversation.id).limit(SETTINGS.retention_batch_size)
+            if last is not None:
+                statement = statement.where(Conversation.id > last)
+            ids = await self.database.get_all(statement)
+            if not ids:
+                return
+            last = ids[-1]
+            ids = [conversation_id for conversation_id in ids if not _active(conversation_id)]
+            if ids:
+                await self._delete(None, and_(Conversation.id.in_(ids), condition), reason, archive, report)
+
+    async def _trim_messages(self, archive: _Archive | None, report: Dict[str, int]) -> None:
+        # Keeps the system message and the newest messages of each conversation
+        limit = SETTINGS.retention_max_messages_per_conversation
+        last = None
+        while True:
+            statement = (
+                select(Message.conversation_id).where(Message.seq > 0)
+                .group_by(Message.conversation_id).having(func.count() > limit)
+                .order_by(Message.conversation_id).limit(SETTINGS.retention_batch_size)
+            )
+            if last is not None:
+                statement = statement.where(Message.conversation_id > last)
+            ids = await self.database.get_all(statement)
+            if not ids:
+                return
+            last = ids[-1]
+            ids = [conversation_id for conversation_id in ids if not _active(conversation_id)]
+            if not ids:
+                continue
+            rank = func.row_number().over(partition_by=Message.conversation_id, order_by=Message.seq.desc()).label("rank")
+            ranked = select(Message.id, rank).where(Message.conversation_id.in_(ids), Message.seq > 0).subquery()
+            await self._delete(Message.id.in_(select(ranked.c.id).where(ranked.c.rank > limit)), None, "max_messages", archive, report)
+
+    async def _delete(self, messages: Any, conversations: Any, reason: str, archive: _Archive | None, report: Dict[str, int]) -> None:
+        # Archive, then delete children first, in one transaction. Either messages or conversations (with their messages) go
+        async with self.database.session() as session:
+            conversation_ids = None
+            if conversations is not None:
+                # Re-checked under the transaction's locks, a conversation written to since it was picked stays
+                conversation_ids = (await session.exec(select(Conversation.id).where(conversations).with_for_update())).all()
+                if not conversation_ids:
+                    return
+                messages = Message.conversation_id.in_(conversation_ids)
+            if archive is not None:
+                records = await self._records(session, messages, conversation_ids, reason)
+                await asyncio.to_thread(archive.write, records)
+            result = await session.exec(delete(ToolCall).where(ToolCall.message_id.in_(select(Message.id).where(messages))))
+            report["tool_calls"] += result.rowcount
+            result = await session.exec(delete(Message).where(messages))
+            report["messages"] += result.rowcount
+            if conversation_ids:
+                result = await session.exec(delete(Conversation).where(Conversation.id.in_(conversation_ids)))
+                report["conversations"] += result.rowcount
+            await session.commit()
+
+    async def _records(self, session: Any, messages: Any, conversation_ids: List[UUID] | None, reason: str) -> List[Dict[str, Any]]:
+        # One JSONL record per conversation, with the archived messages and their tool calls
+        rows = (await session.exec(select(Message).where(messages).order_by(Message.conversation_id, Message.seq))).all()
+        grouped = {conversation_id: [_message_record(row) for row in group] for conversation_id, group in groupby(rows, key=lambda row: row.conversation_id)}
+        archived_at = datetime.now(timezone.utc).isoformat()
+        if conversation_ids is None:
+            return [
+                {"reason": reason, "archived_at": archived_at, "conversation_id": str(conversation_id), "messages": group}
+                for conversation_id, group in grouped.items()
+            ]
+        conversations = (await session.exec(select(Conversation).where(Conversation.id.in_(conversation_ids)))).all()
+        return [
+            {"reason": reason, "archived_at": archived_at, "conversation_id": str(conversation.id),
+             "conversation": conversation.model_dump(mode="json"), "messages": grouped.get(conversation.id, [])}
+            for conversation in conversations
+        ]
+
+    async def _database_size(self) -> int:
+        async with self.database.engine.connect() as connection:
+            if connection.dialect.name == "sqlite":
+                page_count = (await connection.exec_driver_sql("PRAGMA page_count")).scalar()
+                page_size = (await connection.exec_driver_sql("PRAGMA page_size")).scalar()
+                return page_count * page_size
+            if connection.dialect.name == "postgresql":
+                return (await connection.exec_driver_sql("SELECT pg_database_size(current_database())")).scalar()
+            return 0
+
+    async def _compact(self) -> None:
+        async with self.database.engine.connect() as connection:
+            # VACUUM can't run inside a transaction
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            if connection.dialect.name == "sqlite":
+                if (await connection.exec_driver_sql("PRAGMA auto_vacuum")).scalar() != 2:
+                    # Once per database file: switching to incremental auto vacuum takes a full rewrite
+                    logger.info("Converting the database to incremental auto vacuum")
+                    await connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                    await connection.exec_driver_sql("VACUUM")
+                else:
+                    # Frees a page per step, a plain execute only runs the first step
+                    raw = await connection.get_raw_connection()
+                    await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({SETTINGS.retention_vacuum_pages});")
+                await connection.exec_driver_sql("ANALYZE")
+            elif connection.dialect.name == "postgresql":
+                await connection.exec_driver_sql("VACUUM (ANALYZE) tool_call, message, conversation")
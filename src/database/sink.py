@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+from sqlmodel import update
+from typing import Any, Literal
+from uuid import UUID
+from weakref import WeakValueDictionary
+import asyncio
+import logging
+from src.config import SETTINGS
+from src.database.db import Database
+from src.database.models import Conversation
+from src.telemetry import span
+from src.singleton import SingletonMeta
+
+logger = logging.getLogger(__name__)
+
+Durability = Literal["flush_before_reply", "async"]
+
+class MessageSink(metaclass=SingletonMeta):
+    """Write-behind buffer for conversation rows.
+
+    Rows are buffered per conversation and written in a single transaction at
+    the end of an agent turn, or earlier once `max_buffered` rows are pending
+    or `flush_interval` seconds have passed since the first buffered row.
+    """
+
+    def __init__(self) -> None:
+        self.database = Database()
+        self.durability: Durability = SETTINGS.message_sink_durability
+        self._max_buffered = SETTINGS.message_sink_max_buffered
+        self._flush_interval = SETTINGS.message_sink_flush_interval_seconds
+        self._buffers: dict[UUID, list[Any]] = {}
+        self._timers: dict[UUID, asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+        # Serialize flushes per conversation so rows are committed in order
+        self._locks: WeakValueDictionary[UUID, asyncio.Lock] = WeakValueDictionary()
+
+    def pending(self, conversation_id: UUID | None = None) -> int:
+        if conversation_id is None:
+            return sum(len(buffer) for buffer in self._buffers.values())
+        return len(self._buffers.get(conversation_id, []))
+
+    async def add(self, conversation_id: UUID, row: Any) -> None:
+        buffer = self._buffers.setdefault(conversation_id, [])
+        buffer.append(row)
+        if len(buffer) >= self._max_buffered:
+            await self.flush(conversation_id)
+        elif conversation_id not in self._timers:
+            self._timers[conversation_id] = asyncio.create_task(self._flush_later(conversation_id))
+
+    async def end_turn(self, conversation_id: UUID) -> None:
+        # Called right before the agent replies to the user
+        if self.durability == "flush_before_reply":
+            await self.flush(conversation_id)
+        else:
+            task = asyncio.create_task(self._flush_logged(conversation_id))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def flush(self, conversation_id: UUID) -> int:
+        lock = self._locks.get(conversation_id)
+        if lock is None:
+            lock = self._locks[conversation_id] = asyncio.Lock()
+        async with lock:
+            timer = self._timers.pop(conversation_id, None)
+            if timer is not None and timer is not asyncio.current_task():
+                timer.cancel()
+            rows = self._buffers.pop(conversation_id, [])
+            if not rows:
+                return 0
+            try:
+                # Bump the conversation's last activity in the same transaction
+                touch = update(Conversation).where(Conversation.id == conversation_id).values(updated_at=datetime.now(timezone.utc))
+                with span("persist"):
+                    await self.database.create_all(rows, [touch])
+            except Exception:
+                # Put the rows back in front of anything buffered meanwhile, a later flush retries them
+                self._buffers[conversation_id] = rows + self._buffers.get(conversation_id, [])
+                raise
+            return len(rows)
+
+    async def drain(self) -> None:
+        # Wait for in-flight async flushes, then write whatever is still buffered
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        for timer in list(self._timers.values()):
+            timer.cancel()
+        self._timers.clear()
+        for conversation_id in list(self._buffers):
+            await self._flush_logged(conversation_id)
+
+    async def _flush_later(self, conversation_id: UUID) -> None:
+        await asyncio.sleep(self._flush_interval)
+        await self._flush_logged(conversation_id)
+
+    async def _flush_logged(self, conversation_id: UUID) -> None:
+        try:
+            await self.flush(conversation_id)
+        except Exception:
+            logger.exception("Failed to flush messages of conversation %s", conversation_id)
@@ -3,16 +3,35 @@ from src.routes import router, runtime
 from contextlib import asynccontextmanager
 from src.database.models import User, Conversation, Message
 from src.runtime import RuntimeManager
+from src.database.db import Database
+from src.database.retention import RetentionWorker
+from src.tools.client_factory import ClientFactory
+from src.tools.calendar_api_client import CalendarAPIClient
+from src.resume import check_resume_secret
 
 runtime = RuntimeManager()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Refuse to hand out resume tokens the other processes couldn't verify.
+    check_resume_secret()
+    # Load credentials, the calendar discovery document and the model client before the first connection.
+    ClientFactory().warm_up()
+    # Build the tool argument models and JSON schemas shared by every agent.
+    CalendarAPIClient.tool_specs()
     # Start the runtime (Start processing messages).
-    runtime.start()
+    await runtime.start()
+    # Prune expired conversations in the background (when a retention policy is set).
+    RetentionWorker().start()
     yield
+    # Stop pruning before the agents write out their last messages.
+    await RetentionWorker().stop()
     # Stop the runtime (Stop processing messages).
     await runtime.stop_when_idle()
+    # Close pooled database connections.
+    await Database().dispose()
+    # Close the shared model client.
+    await ClientFactory().close()
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(router)
@@ -0,0 +1,40 @@
+from uuid import UUID
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+from src.config import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+if SETTINGS.resume_secret:
+    _SECRET = SETTINGS.resume_secret.encode()
+else:
+    _SECRET = secrets.token_bytes(32)
+    logger.warning("MY_RESUME_SECRET is not set, resume tokens are only valid until this process exits")
+
+def check_resume_secret() -> None:
+    # A token issued by one process must verify on any other the client reconnects to
+    workers = os.environ.get("WEB_CONCURRENCY", "1")
+    if not SETTINGS.resume_secret and (SETTINGS.runtime_mode == "grpc" or (workers.isdigit() and int(workers) > 1)):
+        raise RuntimeError("MY_RESUME_SECRET must be set when several processes serve websockets (grpc mode or WEB_CONCURRENCY > 1)")
+
+def _signature(user_id: UUID, conversation_id: UUID, expires: int) -> str:
+    digest = hmac.new(_SECRET, f"{user_id}:{conversation_id}:{expires}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def issue_resume_token(user_id: UUID, conversation_id: UUID) -> str:
+    # "<expiry>.<signature>", binds the conversation to the user it was started by
+    expires = int(time.time() + SETTINGS.resume_token_ttl_seconds)
+    return f"{expires}.{_signature(user_id, conversation_id, expires)}"
+
+def verify_resume_token(token: str | None, user_id: UUID, conversation_id: UUID) -> bool:
+    if not token:
+        return False
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(user_id, conversation_id, int(expires)))
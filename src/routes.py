@@ -1,20 +1,38 @@
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, Depends, status
+from fastapi.responses import PlainTextResponse
 from autogen_core import AgentId, SingleThreadedAgentRuntime
-from src.tools.messages import CustomMessage
+from src.tools.messages import CustomMessage, StreamFrame
+from src.agents.streaming import StreamHub
+from src.agents.context import ContextCache
+from src.database.sink import MessageSink
+from src.telemetry import Metrics, span
+from src.scheduler import RequestScheduler
 from src.database.repository import UserRepository
 from src.database.models import User
 from sqlmodel import Session
 from typing import List
 from autogen_core.tools import Tool
-from src.agents.calendar_agent import CalendarAssistantAgent
-from src.tools.calendar_api_client import CalendarAPIClient
 import uuid
+import asyncio
+import logging
 from src.runtime import RuntimeManager
-from autogen_ext.models.openai import OpenAIChatCompletionClient
+from src.tools.calendar_api_client import CalendarAPIClient, user_time_zone
+from src.resume import issue_resume_token, verify_resume_token
 from src.config import SETTINGS
 
+logger = logging.getLogger(__name__)
+
 # Create a runtime.
 runtime = RuntimeManager();
+streams = StreamHub()
+
+# Gauges read on every /metrics scrape
+Metrics().gauge("calendar_agent_agents", runtime.agent_stats, help="Agent instances in this process (live) and lifetime evictions/re-creations.", label="state")
+Metrics().gauge("calendar_agent_cached_conversations", lambda: len(ContextCache()), help="Conversation contexts held in memory.")
+Metrics().gauge("calendar_agent_buffered_messages", lambda: MessageSink().pending(), help="Rows waiting in the write-behind sink.")
+Metrics().gauge("calendar_agent_scheduler_queue_depth", RequestScheduler().queue_depths, help="Requests waiting for a slot, by backend.", label="backend")
+Metrics().gauge("calendar_agent_scheduler_in_flight", RequestScheduler().in_flight, help="Requests being sent, by backend.", label="backend")
+Metrics().gauge("calendar_agent_scheduler_concurrency_limit", RequestScheduler().limits, help="Adaptive concurrency limit, by backend.", label="backend")
 
 calendar_assistant_agent = AgentId("calendar_assistant_agent", "default") # define calendar agent ID
 
@@ -28,10 +46,21 @@ class ConnectionManager:
         self.active_connections.append(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
 
     async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        with span("websocket_send"):
+            await websocket.send_text(message)
+
+    async def send_frame(self, frame: StreamFrame, websocket: WebSocket):
+        with span("websocket_send"):
+            await websocket.send_json(frame.model_dump(exclude_none=True))
+
+    async def send_frames(self, frames: asyncio.Queue[StreamFrame], websocket: WebSocket):
+        # Forward queued stream frames as JSON, in order
+        while True:
+            await self.send_frame(await frames.get(), websocket)
 
 manager = ConnectionManager()
 
@@ -41,38 +70,87 @@ router = APIRouter()
 async def root():
     return {"message": "Server Running"}
 
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(Metrics().render(), media_type="text/plain; version=0.0.4")
+
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint( websocket: WebSocket, user_id: str):
+async def websocket_endpoint( websocket: WebSocket, user_id: str, stream: bool = False, session: bool = False,
+        conversation_id: uuid.UUID | None = None, resume_token: str | None = None):
     users = UserRepository()
     # Fetch User data from database
-    user = users.get(user_id)
-
-    calendar_api_client = CalendarAPIClient(user)
-    
-    calendar_agent = CalendarAssistantAgent(
-        model_client=OpenAIChatCompletionClient(
-            model="gpt-4o-mini",
-            api_key=SETTINGS.openai_api_key,
-        ),
-        tool_schema=calendar_api_client.get_tools(),
-    )
-
-    # Create new conversation id
-    conversation_id = uuid.uuid4();
-
-    agent_id = AgentId(type="calendar_agent", key=f"calendar-agent-{user.id}-{conversation_id}")
-    # Register the calendar assistant agent
-    await runtime.register_agent_instance(calendar_agent, agent_id)
-
-    await manager.connect(websocket)
+    user = await users.get(user_id)
+
+    if conversation_id is None:
+        # Create new conversation id
+        conversation_id = uuid.uuid4();
+    elif not verify_resume_token(resume_token, user.id, conversation_id):
+        # Only the user the conversation was started by gets a valid token for it
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # The runtime creates the agent on the user's shard when the first message arrives
+    agent_id = runtime.agent_id(user.id, conversation_id)
+    # A reconnecting client finds its agent still live within the grace period, otherwise the context cache or the database fill in
+    warm = runtime.attach(agent_id) or conversation_id in ContextCache()
+    if resume_token is not None:
+        Metrics().inc("calendar_agent_resumes_total", help="Resumed conversations, by whether their state was still in memory.", state="warm" if warm else "cold")
+
+    # Load the next days of events while the user types, only useful where the user's agents run
+    prefetch = None
+    # In stream mode the client receives JSON frames (tokens, tool progress, done) instead of one text reply
+    sender = None
     try:
+        await manager.connect(websocket)
+        if SETTINGS.calendar_prefetch_days > 0 and runtime.is_local(user.id):
+            prefetch = asyncio.create_task(CalendarAPIClient(user).prefetch(SETTINGS.calendar_prefetch_days, user_time_zone(user)))
+        # Tells the client how to resume this conversation
+        session_frame = StreamFrame(type="session", conversation_id=str(conversation_id), resume_token=issue_resume_token(user.id, conversation_id))
+        if stream:
+            frames = streams.open(conversation_id)
+            sender = asyncio.create_task(manager.send_frames(frames, websocket))
+            await frames.put(session_frame)
+        elif session:
+            await websocket.send_json(session_frame.model_dump(exclude_none=True))
         while True:
             # Receive message from websocket
             message =  CustomMessage(user_id=user.id, conversation_id=conversation_id, content=await websocket.receive_text())
-            # Send the message to the calendar assistant agent
-            response = await runtime.send_message(message, agent_id)
-            await manager.send_message(f"Assistant: {response.content}", websocket)
+            try:
+                # Send the message to the calendar assistant agent
+                response = await runtime.send_message(message, agent_id)
+                reply = StreamFrame(type="done", content=response.content)
+            except Exception:
+                # The connection stays usable, the client can send the message again
+                logger.exception("Turn of conversation %s failed", conversation_id)
+                reply = StreamFrame(type="error", content="The assistant could not answer this message, please try again.")
+            if stream:
+                # Goes through the same queue so it arrives after the streamed tokens
+                if not await streams.publish(conversation_id, reply):
+                    # The stream was closed on a stalled client, the reply goes to it directly and the next turn streams again
+                    sender.cancel()
+                    try:
+                        await asyncio.wait_for(manager.send_frame(reply, websocket), SETTINGS.stream_send_timeout_seconds)
+                    except asyncio.TimeoutError:
+                        # Still not reading, the client can resume the conversation on a new connection
+                        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Stalled stream, resume the conversation")
+                        return
+                    frames = streams.open(conversation_id)
+                    sender = asyncio.create_task(manager.send_frames(frames, websocket))
+            elif reply.type == "done":
+                await manager.send_message(f"Assistant: {reply.content}", websocket)
+            else:
+                await manager.send_message(f"Error: {reply.content}", websocket)
     except WebSocketDisconnect:
-        # TODO: Delete conversation from database
-        # Disconnect websocket
-        manager.disconnect(websocket)
\ No newline at end of file
+        # The conversation is kept for resuming, the retention worker prunes it once it expires
+        pass
+    finally:
+        # Runs on any way out, so the agent gets the resume grace instead of living on until its idle timeout
+        manager.disconnect(websocket)
+        if prefetch is not None:
+            # Stops waiting for it, a request already sent still fills the cache
+            prefetch.cancel()
+        if sender is not None:
+            sender.cancel()
+            streams.close(conversation_id, frames)
+        # Let the runtime drop the agent once no client is left, it is re-created if the conversation continues
+        await runtime.release(agent_id)
@@ -1,33 +1,198 @@
-from autogen_core import AgentId, SingleThreadedAgentRuntime
+from autogen_core import AgentId, SingleThreadedAgentRuntime, try_get_known_serializers_for_type
 from src.tools.messages import CustomMessage
-from src.agents.calendar_agent import CalendarAssistantAgent
-
-class RuntimeManagerMeta(type):
-    _instances = {}
-
-    def __call__(cls, *args, **kwargs):
-        """
-        Possible changes to the value of the `__init__` argument do not affect
-        the returned instance.
-        """
-        if cls not in cls._instances:
-            instance = super().__call__(*args, **kwargs)
-            cls._instances[cls] = instance
-        return cls._instances[cls]
-
-class RuntimeManager(metaclass=RuntimeManagerMeta):
+from src.agents.calendar_agent import CalendarAssistant, CalendarAssistantAgent
+from src.agents.registry import AgentRegistry
+from src.agents.context_providers import current_time, todays_events
+from src.database.sink import MessageSink
+from src.database.repository import UserRepository
+from src.tools.calendar_api_client import CalendarAPIClient, user_time_zone
+from src.tools.client_factory import ClientFactory
+from src.config import SETTINGS
+from typing import Dict, List, Tuple
+import asyncio
+import logging
+from uuid import UUID
+import zlib
+from src.singleton import SingletonMeta
+
+logger = logging.getLogger(__name__)
+
+AGENT_TYPE = "calendar_agent"
+AGENT_KEY_PREFIX = "calendar-agent-"
+
+def agent_key(user_id: UUID, conversation_id: UUID) -> str:
+    return f"{AGENT_KEY_PREFIX}{user_id}-{conversation_id}"
+
+def parse_agent_key(key: str) -> Tuple[str, str]:
+    # Both ids are 36 character UUID strings joined with "-"
+    ids = key[len(AGENT_KEY_PREFIX):]
+    return ids[:36], ids[37:]
+
+def shard_for(user_id: UUID, shard_count: int) -> int:
+    # Stable across processes (unlike hash()), so every worker routes a user to the same shard
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+# Assistants being constructed, concurrent first messages to the same id share one
+_agents_in_construction: Dict[AgentId, asyncio.Future] = {}
+
+async def calendar_assistant(agent_id: AgentId) -> CalendarAssistant:
+    # Looked up by the agent id's handle on every message, built on the first one (and again after an eviction)
+    registry = AgentRegistry()
+    agent = registry.agent(agent_id)
+    if agent is not None:
+        return agent
+    if agent_id in _agents_in_construction:
+        # Hand out the instance the first message is building
+        return await asyncio.shield(_agents_in_construction[agent_id])
+    future = _agents_in_construction[agent_id] = asyncio.get_running_loop().create_future()
+    try:
+        user_id, _ = parse_agent_key(agent_id.key)
+        user = await UserRepository().get(user_id)
+        factory = ClientFactory()
+        client = CalendarAPIClient(user)
+        time_zone = user_time_zone(user)
+        context_providers = [current_time(time_zone)]
+        if SETTINGS.context_todays_events:
+            context_providers.append(todays_events(client, time_zone))
+        agent = CalendarAssistant(
+            agent_id,
+            model_client=factory.model_client(),
+            tool_schema=client.get_tools(),
+            context_providers=context_providers,
+        )
+        registry.created(agent_id, agent)
+        future.set_result(agent)
+        return agent
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Retrieve it so a construction nobody else waited for doesn't log a warning
+        future.exception()
+        raise
+    finally:
+        del _agents_in_construction[agent_id]
+
+class RuntimeManager(metaclass=SingletonMeta):
+    """Runs calendar agents either in-process ("local") or sharded over gRPC workers ("grpc").
+
+    In gRPC mode every user is mapped to one of `runtime_shard_count` agent
+    types. Each worker process registers the shards listed in
+    `runtime_shard_indexes` with the host, which routes messages from any
+    websocket worker to the process owning the user's shard.
+    """
+
     def __init__(self) -> None:
-        self._runtime = SingleThreadedAgentRuntime()
+        self._mode = SETTINGS.runtime_mode
+        self._host = None
+        self._registry = AgentRegistry()
+        self._sweeper: asyncio.Task | None = None
+        # Open websockets per agent, a reconnecting client can briefly have two
+        self._connections: Dict[AgentId, int] = {}
+        if self._mode == "grpc":
+            # Imported lazily, the grpc extra is only needed for this mode
+            from autogen_ext.runtimes.grpc import GrpcWorkerAgentRuntime
+            self._shard_count = SETTINGS.runtime_shard_count
+            self._runtime = GrpcWorkerAgentRuntime(host_address=SETTINGS.runtime_host_address)
+            self._runtime.add_message_serializer(try_get_known_serializers_for_type(CustomMessage))
+        else:
+            self._shard_count = 1
+            self._runtime = SingleThreadedAgentRuntime()
+
+    @property
+    def owned_shards(self) -> List[int]:
+        if SETTINGS.runtime_shard_indexes is None:
+            # Local mode or a single process with an embedded host
+            return list(range(self._shard_count))
+        return SETTINGS.runtime_shard_indexes
+
+    def agent_type(self, shard: int) -> str:
+        return AGENT_TYPE if self._mode == "local" else f"{AGENT_TYPE}_shard_{shard}"
+
+    def agent_id(self, user_id: UUID, conversation_id: UUID) -> AgentId:
+        # Sticky routing: a user's conversations always go to the same shard
+        return AgentId(type=self.agent_type(shard_for(user_id, self._shard_count)), key=agent_key(user_id, conversation_id))
     
-    def start(self) -> None:
-        self._runtime.start()
+    def is_local(self, user_id: UUID) -> bool:
+        # Whether the user's agents run in this process (and share its caches)
+        return shard_for(user_id, self._shard_count) in self.owned_shards
+
+    async def start(self) -> None:
+        if self._mode == "grpc":
+            self._check_shards()
+            if SETTINGS.runtime_embedded_host:
+                # Single box setup, host and worker share the process
+                from autogen_ext.runtimes.grpc import GrpcWorkerAgentRuntimeHost
+                self._host = GrpcWorkerAgentRuntimeHost(address=SETTINGS.runtime_host_address)
+                self._host.start()
+            await self._runtime.start()
+        else:
+            self._runtime.start()
+        for shard in self.owned_shards:
+            await CalendarAssistantAgent.register(self._runtime, self.agent_type(shard), lambda: CalendarAssistantAgent(calendar_assistant))
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    def _check_shards(self) -> None:
+        # The host rejects a second registration of the same agent type, e.g. from another uvicorn worker
+        if SETTINGS.runtime_shard_indexes is None and not SETTINGS.runtime_embedded_host:
+            raise RuntimeError(
+                "MY_RUNTIME_SHARD_INDEXES must be set in grpc mode, e.g. MY_RUNTIME_SHARD_INDEXES=[0] for one of "
+                f"{self._shard_count} shards (or [] to only serve websockets), with one process per set of shards"
+            )
+        invalid = [shard for shard in self.owned_shards if not 0 <= shard < self._shard_count]
+        if invalid or len(set(self.owned_shards)) != len(self.owned_shards):
+            raise RuntimeError(f"MY_RUNTIME_SHARD_INDEXES={self.owned_shards} must be distinct shards in 0..{self._shard_count - 1}")
 
     async def stop_when_idle(self) -> None:
-        await self._runtime.stop_when_idle()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        if self._mode == "grpc":
+            await self._runtime.stop()
+            if self._host is not None:
+                await self._host.stop()
+        else:
+            await self._runtime.stop_when_idle()
+        # Write out messages still buffered by the agents
+        await MessageSink().drain()
 
     async def send_message(self, message: CustomMessage, agent_id: AgentId) -> CustomMessage:
         response = await self._runtime.send_message(message, agent_id)
         return response
-    async def register_agent_instance(self, calendar_agent: CalendarAssistantAgent, agent_id: AgentId):
-        response = await self._runtime.register_agent_instance(calendar_agent, agent_id)
-        return response
+
+    def agent_stats(self) -> Dict[str, int]:
+        return self._registry.stats()
+
+    def attach(self, agent_id: AgentId) -> bool:
+        # Whether the agent is still live in this process (always False for agents on other shards)
+        self._connections[agent_id] = self._connections.get(agent_id, 0) + 1
+        return self._registry.attach(agent_id)
+
+    async def release(self, agent_id: AgentId) -> None:
+        remaining = self._connections.get(agent_id, 1) - 1
+        if remaining > 0:
+            # Another websocket still talks to this agent
+            self._connections[agent_id] = remaining
+            return
+        self._connections.pop(agent_id, None)
+        # Agents on other shards are not visible here, their idle timeout takes care of them
+        self._registry.release(agent_id)
+        await self.evict_idle()
+
+    async def evict_idle(self) -> None:
+        for agent_id in self._registry.evictable(SETTINGS.agent_idle_timeout_seconds, SETTINGS.agent_max_live, SETTINGS.agent_resume_grace_seconds):
+            await self._evict(agent_id)
+
+    async def _evict(self, agent_id: AgentId) -> None:
+        # The runtime keeps the id's handle, which builds a new assistant on the next message
+        agent = self._registry.removed(agent_id)
+        if agent is not None:
+            await agent.close()
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(SETTINGS.agent_sweep_interval_seconds)
+            try:
+                await self.evict_idle()
+            except Exception:
+                logger.exception("Failed to evict idle agents")
@@ -0,0 +1,19 @@
+"""Standalone gRPC host that routes messages between sharded runtime workers.
+
+Run it once, then start one API process per set of shards, e.g. on a single box:
+
+    python -m src.runtime_host
+    MY_RUNTIME_MODE=grpc MY_RUNTIME_SHARD_COUNT=2 MY_RUNTIME_SHARD_INDEXES=[0] uvicorn src.main:app --port 8000
+    MY_RUNTIME_MODE=grpc MY_RUNTIME_SHARD_COUNT=2 MY_RUNTIME_SHARD_INDEXES=[1] uvicorn src.main:app --port 8001
+"""
+from autogen_ext.runtimes.grpc import GrpcWorkerAgentRuntimeHost
+from src.config import SETTINGS
+import asyncio
+
+async def main() -> None:
+    host = GrpcWorkerAgentRuntimeHost(address=SETTINGS.runtime_host_address)
+    host.start()
+    await host.stop_when_signal()
+
+if __name__ == "__main__":
+    asyncio.run(main())
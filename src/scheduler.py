@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from itertools import count
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator, List, Tuple, TypeVar
+import asyncio
+import heapq
+import logging
+import random
+import time
+from src.config import SETTINGS
+from src.telemetry import Metrics
+from src.singleton import SingletonMeta
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Lower runs first when requests queue for a backend
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# Who a request is made for, set around a turn (or a prefetch) and read by every call made inside it
+_current_user: ContextVar[Hashable | None] = ContextVar("scheduler_user", default=None)
+_current_priority: ContextVar[int] = ContextVar("scheduler_priority", default=INTERACTIVE)
+
+@contextmanager
+def scheduling(user_id: Hashable | None = None, priority: int | None = None) -> Iterator[None]:
+    tokens = []
+    if user_id is not None:
+        tokens.append((_current_user, _current_user.set(user_id)))
+    if priority is not None:
+        tokens.append((_current_priority, _current_priority.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class _Backend:
+    """Buckets and the adaptive (AIMD) concurrency limit of one upstream API."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.bucket = TokenBucket(SETTINGS.scheduler_rates.get(name, 10.0), SETTINGS.scheduler_burst)
+        self.user_rate = SETTINGS.scheduler_user_rates.get(name, 5.0)
+        self.user_buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self.max_limit = SETTINGS.scheduler_max_concurrency.get(name, 16)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = count()
+
+    def user_bucket(self, user_id: Hashable) -> TokenBucket:
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self.user_buckets[user_id] = TokenBucket(self.user_rate, SETTINGS.scheduler_burst)
+            # Forget users whose buckets have refilled, they behave like new ones
+            if len(self.user_buckets) > SETTINGS.scheduler_max_tracked_users:
+                for key in [key for key, idle in self.user_buckets.items() if key != user_id and idle.full]:
+                    del self.user_buckets[key]
+        self.user_buckets.move_to_end(user_id)
+        return bucket
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+    async def acquire(self, priority: int) -> None:
+        if self.in_flight < int(self.limit) and not self.queued:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Handed a slot right before being cancelled, give it to the next one
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def succeeded(self) -> None:
+        # Additive increase, about one slot per `limit` successful requests
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def throttled(self) -> None:
+        # Multiplicative decrease
+        self.limit = max(1.0, self.limit / 2)
+
+    def _wake(self) -> None:
+        while self.waiters and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+class RequestScheduler(metaclass=SingletonMeta):
+    """Admission control for the OpenAI and Google Calendar calls of the whole process.
+
+    A request waits for its user's token bucket, the backend's global bucket and
+    a slot under the backend's concurrency limit, interactive requests first.
+    Rate limit errors halve the limit and are retried after `Retry-After` or a
+    jittered exponential backoff; successes grow the limit back.
+    """
+
+    def __init__(self) -> None:
+        self._backends: Dict[str, _Backend] = {}
+        self._metrics = Metrics()
+
+    def backend(self, name: str) -> _Backend:
+        backend = self._backends.get(name)
+        if backend is None:
+            backend = self._backends[name] = _Backend(name)
+        return backend
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {name: backend.queued for name, backend in self._backends.items()}
+
+    def in_flight(self) -> Dict[str, int]:
+        return {name: backend.in_flight for name, backend in self._backends.items()}
+
+    def limits(self) -> Dict[str, float]:
+        return {name: round(backend.limit, 2) for name, backend in self._backends.items()}
+
+    async def run(self, name: str, call: Callable[[], Awaitable[T]], idempotent: bool = True) -> T:
+        backend = self.backend(name)
+        for attempt in count():
+            await self._admit(backend)
+            try:
+                result = await call()
+            except Exception as e:
+                error = e
+            else:
+                backend.succeeded()
+                return result
+            finally:
+                backend.release()
+            await self._before_retry(backend, error, attempt, idempotent)
+
+    async def stream(self, name: str, open_stream: Callable[[], AsyncIterator[T]], idempotent: bool = True) -> AsyncIterator[T]:
+        # Holds the slot until the stream ends, only retried while nothing has been yielded
+        backend = self.backend(name)
+        for attempt in count():
+            await self._admit(backend)
+            emitted = False
+            try:
+                async for item in open_stream():
+                    emitted = True
+                    yield item
+            except Exception as e:
+                if emitted:
+                    raise
+                error = e
+            else:
+                backend.succeeded()
+                return
+            finally:
+                backend.release()
+            await self._before_retry(backend, error, attempt, idempotent)
+
+    async def _admit(self, backend: _Backend) -> None:
+        user_id = _current_user.get()
+        if user_id is not None:
+            await backend.user_bucket(user_id).acquire()
+        await backend.bucket.acquire()
+        await backend.acquire(_current_priority.get())
+
+    async def _before_retry(self, backend: _Backend, error: Exception, attempt: int, idempotent: bool) -> None:
+        # Re-raises when the error is not worth retrying
+        throttled, retryable, retry_after = classify(error)
+        if throttled:
+            backend.throttled()
+            self._metrics.inc("calendar_agent_scheduler_throttles_total", help="Rate limit responses, by backend.", backend=backend.name)
+        # Throttled requests were not processed, other failures may have been and are only retried when that is harmless
+        if not (throttled or (retryable and idempotent)) or attempt >= SETTINGS.scheduler_max_retries:
+            raise error
+        delay = backoff(attempt, retry_after)
+        self._metrics.inc("calendar_agent_scheduler_retries_total", help="Retried requests, by backend.", backend=backend.name)
+        logger.warning("Retrying %s request in %.2fs after %r", backend.name, delay, error)
+        await asyncio.sleep(delay)
+
+def backoff(attempt: int, retry_after: float | None) -> float:
+    base = SETTINGS.scheduler_backoff_base_seconds
+    if retry_after is not None:
+        # Spread the clients told to come back at the same moment
+        return min(retry_after, SETTINGS.scheduler_backoff_max_seconds) + random.uniform(0, base)
+    # Full jitter
+    return random.uniform(0, min(SETTINGS.scheduler_backoff_max_seconds, base * 2 ** attempt))
+
+def classify(error: Exception) -> Tuple[bool, bool, float | None]:
+    # (throttled, retryable, retry after seconds) for OpenAI, googleapiclient and network errors
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return False, True, None
+    response = getattr(error, "response", None)
+    resp = getattr(error, "resp", None)
+    status = getattr(error, "status_code", None) or getattr(error, "status", None) or getattr(resp, "status", None)
+    headers = getattr(response, "headers", None) or resp or {}
+    retry_after = _retry_after(headers)
+    if status == 429:
+        return True, True, retry_after
+    if status == 403 and "ratelimitexceeded" in repr(error).replace(" ", "").lower():
+        # Google reports rate limits as 403 rateLimitExceeded / userRateLimitExceeded
+        return True, True, retry_after
+    if status in (500, 502, 503, 504):
+        return False, True, retry_after
+    if status is None and type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return False, True, None
+    return False, False, None
+
+def _retry_after(headers: Any) -> float | None:
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get("retry-after")
+    except AttributeError:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,22 @@
+class SingletonMeta(type):
+    """Metaclass of the process wide services, every call of a class returns its one instance."""
+
+    _instances = {}
+
+    def __call__(cls, *args, **kwargs):
+        """
+        Possible changes to the value of the `__init__` argument do not affect
+        the returned instance.
+        """
+        if cls not in cls._instances:
+            instance = super().__call__(*args, **kwargs)
+            cls._instances[cls] = instance
+        return cls._instances[cls]
+
+    def override(cls, instance) -> None:
+        # Makes `instance` (e.g. of a subclass with fakes) the one returned from now on, before the first call
+        cls._instances[cls] = instance
+
+    def reset(cls) -> None:
+        # Forgets the instance, the next call builds a new one
+        cls._instances.pop(cls, None)
@@ -0,0 +1,126 @@
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+from bisect import bisect_left
+import threading
+import time
+from src.config import SETTINGS
+from src.singleton import SingletonMeta
+
+try:
+    # Optional, traces are only exported when opentelemetry is installed and enabled
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics(metaclass=SingletonMeta):
+    """In-process counters, histograms and gauges rendered in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._gauges: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels: object) -> None:
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            series = self._counters.setdefault(name, {})
+            key = _labels(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, help: str = "", **labels: object) -> None:
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            series = self._histograms.setdefault(name, {})
+            key = _labels(labels)
+            if key not in series:
+                series[key] = Histogram(DEFAULT_BUCKETS)
+            series[key].observe(value)
+
+    def gauge(self, name: str, collect: Callable[[], Dict[str, float] | float], help: str = "", label: str = "") -> None:
+        # `collect` is called on every scrape; a dict return becomes one series per key under `label`
+        def series() -> Dict[Labels, float]:
+            values = collect()
+            if isinstance(values, dict):
+                return {((label, str(key)),): value for key, value in values.items()}
+            return {(): values}
+        with self._lock:
+            self._help[name] = ("gauge", help)
+            self._gauges[name] = series
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._counters.items():
+                self._header(lines, name)
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, series in self._histograms.items():
+                self._header(lines, name)
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            gauges = list(self._gauges.items())
+        for name, series in gauges:
+            self._header(lines, name)
+            for labels, value in series().items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], name: str) -> None:
+        kind, help = self._help[name]
+        if help:
+            lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+
+_tracer = trace.get_tracer("calendar-assistant-agent") if trace is not None else None
+
+@contextmanager
+def span(stage: str, **attributes: object) -> Iterator[None]:
+    """Time a stage of the agent loop into `calendar_agent_stage_seconds` (and an OpenTelemetry span)."""
+    with ExitStack() as stack:
+        if _tracer is not None and SETTINGS.otel_enabled:
+            stack.enter_context(_tracer.start_as_current_span(stage, attributes={key: str(value) for key, value in attributes.items()}))
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            Metrics().observe(
+                "calendar_agent_stage_seconds", time.perf_counter() - start,
+                help="Duration of each stage of the agent loop.", stage=stage, error="true" if error else "false", **attributes,
+            )
@@ -1,82 +1,275 @@
-from autogen_core.tools import FunctionTool
 from src.tools.messages import CalendarEvent, EventDateTime, UserData
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+from src.tools.shared_tool import SharedTool, ToolSpec
 from autogen_core.tools import Tool
+from src.tools.client_factory import ClientFactory
+from src.tools.event_cache import EventCache, Event, event_bounds, parse_datetime
+from src.tools.free_busy import expand_occurrences, find_overlaps, free_slots, working_windows
+from src.tools.serializers import format_events, format_mutation, format_range
 from src.config import SETTINGS
-from datetime import datetime
-from pathlib import Path
-from typing import List
+from src.telemetry import span
+from src.scheduler import BACKGROUND, RequestScheduler, scheduling
+from datetime import datetime, time, timedelta, tzinfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from typing import Any, Callable, ClassVar, Dict, List, Tuple
+import asyncio
+import logging
 import tzlocal
 
-# Path to the service account JSON file for Google API authentication. 
-service_account_file_path = Path(__file__).parent / "service_account.json"
+logger = logging.getLogger(__name__)
+
+def user_time_zone(user: UserData | None) -> tzinfo:
+    if user is not None and user.timezone:
+        try:
+            return ZoneInfo(user.timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning("Unknown time zone %r of user %s", user.timezone, user.id)
+    return tzlocal.get_localzone()
+
+# Most calls Google accepts in one Calendar batch request
+BATCH_LIMIT = 50
+
+# Tool methods and their descriptions, in the order they are sent to the model
+TOOL_DESCRIPTIONS = {
+    "get_date_and_time": "Use this tool to fetch current date and time.",
+    "add_event_to_calendar": "Use to add event to calendar.",
+    "fetch_events": "Use this tool to fetch events from the calendar. Use offset to page through long results.",
+    "find_conflicts": "Use this tool to check whether an event (including its recurrences) conflicts with existing events.",
+    "find_free_slots": "Use this tool to find free time slots of at least duration_minutes within working hours.",
+    "patch_event": "Use the tool to reschedule and update event in the calendar.",
+    "delete_event": "Use this to to delete events in the calendar",
+}
 
 class CalendarAPIClient: 
+    _tool_specs: ClassVar[List[ToolSpec]] = []
+
     def __init__(self, user_data: UserData):
         # TODO: use user data to build api client using token after oauth flow has been setup(for now use service account)
+        self.user_data = user_data
+        self._factory = ClientFactory()
+        self._scheduler = RequestScheduler()
+        self._events_cache = EventCache().calendar(SETTINGS.calendar_id)
+        # Mutations waiting to be sent together, with the futures of their callers
+        self._batch: List[Tuple[Callable[[Any], Any], asyncio.Future]] = []
+        self._sending: set[asyncio.Task] = set()
 
-        # Initialize the Google Calendar API client with service account credentials
-        self.service = build("calendar", "v3", 
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_file_path,
-                scopes=["https://www.googleapis.com/auth/calendar"]
-            )
-        )
+    @property
+    def service(self) -> Any:
+        # Shared Google Calendar service (service account credentials) for the current thread
+        return self._factory.calendar_service()
+
+    async def _execute(self, build_request: Callable[[Any], Any], idempotent: bool = True) -> Any:
+        # Build and execute the request on a worker thread, each thread has its own service/connection
+        loop = asyncio.get_running_loop()
+        return await self._scheduler.run("calendar", lambda: loop.run_in_executor(
+            self._factory.executor(), lambda: build_request(self.service).execute()
+        ), idempotent=idempotent)
+
+    async def _execute_batched(self, build_request: Callable[[Any], Any]) -> Any:
+        # Requests queued by concurrent tool calls are sent as a single multipart batch
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((build_request, future))
+        if len(self._batch) == 1:
+            loop.call_later(SETTINGS.calendar_batch_window_seconds, self._flush_batch)
+        return await future
+
+    def _flush_batch(self) -> None:
+        batch, self._batch = self._batch, []
+        for start in range(0, len(batch), BATCH_LIMIT):
+            task = asyncio.ensure_future(self._send_batch(batch[start:start + BATCH_LIMIT]))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send_batch(self, batch: List[Tuple[Callable[[Any], Any], asyncio.Future]]) -> None:
+        if len(batch) == 1:
+            build_request, future = batch[0]
+            try:
+                result = await self._execute(build_request, idempotent=False)
+            except Exception as e:
+                _resolve(future, exception=e)
+            else:
+                _resolve(future, result)
+            return
+
+        # Batch callbacks run on the worker thread, only collect the results there
+        results: Dict[str, Tuple[Any, Exception | None]] = {}
+
+        def build_batch(service: Any) -> Any:
+            request = service.new_batch_http_request()
+            for index, (build_request, _) in enumerate(batch):
+                request.add(
+                    build_request(service),
+                    callback=lambda request_id, response, exception: results.__setitem__(request_id, (response, exception)),
+                    request_id=str(index),
+                )
+            return request
+
+        try:
+            await self._execute(build_batch, idempotent=False)
+        except Exception as e:
+            for _, future in batch:
+                _resolve(future, exception=e)
+            return
+        # A batch that partly fails still answers every call on its own
+        for index, (_, future) in enumerate(batch):
+            response, exception = results.get(str(index), (None, RuntimeError("Missing response in batch request")))
+            _resolve(future, response, exception)
 
     def get_date_and_time(self) -> str:
-        time_zone = tzlocal.get_localzone() # Detect system timezone
-        date_and_time = datetime.now(time_zone) 
+        # Same zone as the current time given with every turn
+        time_zone = user_time_zone(self.user_data)
+        date_and_time = datetime.now(time_zone)
         return (
             f"Today's date and time: {date_and_time}.\n"
             f"TIME ZONE: {time_zone}.\n"
             f"Today's day of the week: {date_and_time.strftime('%A')}"
         )
 
-    def add_event_to_calendar(self, event: CalendarEvent) -> str:
-        result = self.service.events().insert(
+    async def add_event_to_calendar(self, event: CalendarEvent) -> str:
+        result = await self._execute_batched(lambda service: service.events().insert(
             calendarId=SETTINGS.calendar_id, body=event.model_dump()  # Converts Pydantic model to dict
-        ).execute()
-        return f"Result: {result}"
+        ))
+        self._events_cache.upsert(result)
+        return format_mutation("Created", result)
+
+    async def list_events(self, time_min: EventDateTime, time_max: EventDateTime) -> List[Event]:
+        # Answer from the event cache when the range has already been listed
+        range_start = parse_datetime(time_min.dateTime, time_min.timeZone)
+        range_end = parse_datetime(time_max.dateTime, time_max.timeZone or time_min.timeZone)
+        events = self._events_cache.query(range_start, range_end)
+        if events is not None:
+            return events
 
-    def fetch_events(self, time_min: EventDateTime, time_max: EventDateTime) -> str:
-        events_list = self.service.events().list(
+        # Wait for a wider listing already on its way, like the prefetch started on connect
+        pending = self._events_cache.in_flight_covering(range_start, range_end)
+        if pending is not None:
+            try:
+                await asyncio.shield(pending)
+            except Exception:
+                pass
+            events = self._events_cache.query(range_start, range_end)
+            if events is not None:
+                return events
+
+        # Concurrent turns asking for the same range share one API call
+        key = (range_start, range_end)
+        return await self._events_cache.single_flight(key, lambda: self._fetch_range(time_min, time_max, range_start, range_end))
+
+    async def prefetch(self, days: int, time_zone: tzinfo) -> None:
+        # Load the next `days` days so the first availability or conflict question is answered from memory
+        start = datetime.now(time_zone).replace(hour=0, minute=0, second=0, microsecond=0)
+        try:
+            # Queued behind the requests of running turns
+            with span("prefetch"), scheduling(user_id=self.user_data.id if self.user_data else None, priority=BACKGROUND):
+                await self.list_events(
+                    EventDateTime(dateTime=start.isoformat(), timeZone=str(time_zone)),
+                    EventDateTime(dateTime=(start + timedelta(days=days)).isoformat(), timeZone=str(time_zone)),
+                )
+        except Exception:
+            logger.exception("Failed to prefetch events")
+
+    async def _fetch_range(self, time_min: EventDateTime, time_max: EventDateTime, range_start: datetime, range_end: datetime) -> List[Event]:
+        generation = self._events_cache.generation
+        events_list = await self._execute(lambda service: service.events().list(
                 calendarId=SETTINGS.calendar_id,
                 timeMin=time_min.dateTime,
                 timeMax=time_max.dateTime,
                 timeZone=time_min.timeZone,
                 singleEvents=True,
                 orderBy="startTime"
-        ).execute()
-        if not events_list:
-            return "No events found in this time range."
+        )) or {}
         events = events_list.get("items", [])
-        return f"Events:\n {events}"
+        # Only complete listings can answer later queries
+        if not events_list.get("nextPageToken"):
+            self._events_cache.store(range_start, range_end, events, generation)
+        return events
+
+    async def fetch_events(self, time_min: EventDateTime, time_max: EventDateTime, offset: int = 0) -> str:
+        events = await self.list_events(time_min, time_max)
+        return format_events(events, offset, SETTINGS.fetch_events_page_size, SETTINGS.tool_result_token_budget)
 
-    def patch_event(self, event_id: str, start: EventDateTime, end: EventDateTime) -> str:
-        result = self.service.events().patch(
+    async def find_conflicts(self, event: CalendarEvent) -> str:
+        time_zone = event.start.timeZone
+        start = parse_datetime(event.start.dateTime, time_zone)
+        end = parse_datetime(event.end.dateTime, event.end.timeZone or time_zone)
+        # Check every occurrence of a recurring event within the horizon
+        occurrences = expand_occurrences(
+            start, end, event.recurrence,
+            until=start + timedelta(days=SETTINGS.recurrence_horizon_days),
+            limit=SETTINGS.recurrence_max_occurrences,
+        )
+        if not occurrences:
+            return "No conflicts."
+        events = await self.list_events(
+            EventDateTime(dateTime=occurrences[0][0].isoformat(), timeZone=time_zone),
+            EventDateTime(dateTime=occurrences[-1][1].isoformat(), timeZone=time_zone),
+        )
+        conflicts = find_overlaps(occurrences, events)
+        if not conflicts:
+            return "No conflicts."
+        lines = [
+            f"- {conflict.get('summary', '(no title)')} [{format_range(*event_bounds(conflict))}] id={conflict['id']} "
+            f"overlaps {format_range(*occurrence)}"
+            for occurrence, conflict in conflicts
+        ]
+        return "Conflicts:\n" + "\n".join(lines)
+
+    async def find_free_slots(self, time_min: EventDateTime, time_max: EventDateTime, duration_minutes: int) -> str:
+        time_zone = ZoneInfo(time_min.timeZone) if time_min.timeZone else user_time_zone(self.user_data)
+        # Naive bounds are in the user's time zone, not the server's
+        time_min = EventDateTime(dateTime=time_min.dateTime, timeZone=str(time_zone))
+        time_max = EventDateTime(dateTime=time_max.dateTime, timeZone=time_max.timeZone or str(time_zone))
+        range_start = parse_datetime(time_min.dateTime, time_min.timeZone)
+        range_end = parse_datetime(time_max.dateTime, time_max.timeZone or time_min.timeZone)
+        events = await self.list_events(time_min, time_max)
+        windows = working_windows(
+            range_start, range_end, time_zone,
+            time.fromisoformat(SETTINGS.working_hours_start),
+            time.fromisoformat(SETTINGS.working_hours_end),
+            SETTINGS.working_days,
+        )
+        slots = free_slots(windows, events, timedelta(minutes=duration_minutes))
+        if not slots:
+            return "No free slots in this time range."
+        lines = [f"- {format_range(start.astimezone(time_zone), end.astimezone(time_zone))}" for start, end in slots[:SETTINGS.fetch_events_page_size]]
+        return f"Free slots ({time_zone}):\n" + "\n".join(lines)
+
+    async def patch_event(self, event_id: str, start: EventDateTime, end: EventDateTime) -> str:
+        result = await self._execute_batched(lambda service: service.events().patch(
                 calendarId=SETTINGS.calendar_id,
                 eventId=event_id,
                 body={
                     "start": start.model_dump(),  # Converts Pydantic model to dict
                     "end": end.model_dump(),   
                 }
-        ).execute()
-        return f"Result: {result}"
+        ))
+        self._events_cache.upsert(result)
+        return format_mutation("Updated", result)
 
-    def delete_event(self, event_id: str) -> str:
-        result = self.service.events().delete(
+    async def delete_event(self, event_id: str) -> str:
+        await self._execute_batched(lambda service: service.events().delete(
                 calendarId=SETTINGS.calendar_id,
                 eventId=event_id,
-        ).execute()
-        return f"Result: {result}"
+        ))
+        self._events_cache.remove(event_id)
+        return f"Deleted: {event_id}"
     
+    @classmethod
+    def tool_specs(cls) -> List[ToolSpec]:
+        # Schemas do not depend on the user, build them from any instance once per process
+        if not cls._tool_specs:
+            client = cls(None)
+            cls._tool_specs = [ToolSpec(getattr(client, name), description) for name, description in TOOL_DESCRIPTIONS.items()]
+        return cls._tool_specs
+
     def get_tools(self) -> List[Tool]:
-        tools = [
-            FunctionTool(self.get_date_and_time, description="Use this tool to fetch current date and time."),
-            FunctionTool(self.add_event_to_calendar, description="Use to add event to calendar."),
-            FunctionTool(self.fetch_events, description="Use this tool to fetch events from the calendar."),
-            FunctionTool(self.patch_event, description="Use the tool to reschedule and update event in the calendar."),
-            FunctionTool(self.delete_event, description="Use this to to delete events in the calendar")
-        ]
-        return tools
+        return [SharedTool(spec, getattr(self, spec.name)) for spec in self.tool_specs()]
+
+def _resolve(future: asyncio.Future, result: Any = None, exception: Exception | None = None) -> None:
+    # The caller may have been cancelled meanwhile
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
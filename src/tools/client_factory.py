@@ -0,0 +1,105 @@
+from autogen_core.models import ChatCompletionClient
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from google.oauth2 import service_account
+from src.config import SETTINGS
+from src.tools.scheduled_model_client import ScheduledChatCompletionClient
+from src.tools.completion_cache import CachedChatCompletionClient, DiskCompletionCache, MemoryCompletionCache
+from pathlib import Path
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import json
+from src.singleton import SingletonMeta
+
+# Path to the service account JSON file for Google API authentication. 
+service_account_file_path = Path(__file__).parent / "service_account.json"
+
+class ClientFactory(metaclass=SingletonMeta):
+    """Process wide source of the Google Calendar service and the model client.
+
+    Credentials and the parsed discovery document are loaded once. Calendar
+    service objects wrap a keep-alive httplib2 connection which is not thread
+    safe, so one is built per thread from the cached document.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._credentials: service_account.Credentials | None = None
+        self._discovery_document: dict[str, Any] | None = None
+        self._model_client: ChatCompletionClient | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    def credentials(self) -> service_account.Credentials:
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = service_account.Credentials.from_service_account_file(
+                    service_account_file_path,
+                    scopes=["https://www.googleapis.com/auth/calendar"]
+                )
+            return self._credentials
+
+    def discovery_document(self) -> dict[str, Any]:
+        with self._lock:
+            if self._discovery_document is None:
+                # Use the discovery document bundled with googleapiclient, parsed once
+                self._discovery_document = json.loads(discovery_cache.get_static_doc("calendar", "v3"))
+            return self._discovery_document
+
+    def calendar_service(self) -> Any:
+        service = getattr(self._local, "calendar_service", None)
+        if service is None:
+            service = build_from_document(self.discovery_document(), credentials=self.credentials())
+            self._local.calendar_service = service
+        return service
+
+    def executor(self) -> ThreadPoolExecutor:
+        # Bounded pool that runs the blocking Google API calls off the event loop
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=SETTINGS.calendar_max_workers,
+                    thread_name_prefix="calendar-api",
+                )
+            return self._executor
+
+    def model_client(self) -> ChatCompletionClient:
+        # A single client shares its HTTP connection pool between all agents
+        with self._lock:
+            if self._model_client is None:
+                # Retries are left to the request scheduler, which also sees the other agents' requests
+                self._model_client = self._wrap_model_client(OpenAIChatCompletionClient(
+                    model=SETTINGS.openai_model,
+                    api_key=SETTINGS.openai_api_key,
+                    max_retries=0,
+                ))
+            return self._model_client
+
+    def _wrap_model_client(self, model_client: ChatCompletionClient) -> ChatCompletionClient:
+        model_client = ScheduledChatCompletionClient(model_client)
+        # Outside the scheduler, so cached answers don't wait for a slot
+        if SETTINGS.completion_cache == "memory":
+            cache = MemoryCompletionCache(SETTINGS.completion_cache_ttl_seconds, SETTINGS.completion_cache_max_entries)
+            model_client = CachedChatCompletionClient(model_client, cache, SETTINGS.openai_model)
+        elif SETTINGS.completion_cache == "disk":
+            cache = DiskCompletionCache(SETTINGS.completion_cache_path, SETTINGS.completion_cache_ttl_seconds, SETTINGS.completion_cache_max_entries)
+            model_client = CachedChatCompletionClient(model_client, cache, SETTINGS.openai_model)
+        return model_client
+
+    def warm_up(self) -> None:
+        # Load everything the first websocket connection would otherwise pay for
+        self.credentials()
+        self.discovery_document()
+        self.calendar_service()
+        self.model_client()
+        self.executor()
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._model_client is not None:
+            await self._model_client.close()
+            self._model_client = None
@@ -0,0 +1,243 @@
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    AssistantMessage,
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,
+    ModelInfo,
+    RequestUsage,
+    UserMessage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, AsyncGenerator, Mapping, Sequence, Tuple
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from src.config import SETTINGS
+from src.telemetry import Metrics
+from src.tools.event_cache import EventCache
+
+# Tools that change the calendar, answers given after them depend on state the messages don't show
+MUTATING_TOOLS = frozenset({"add_event_to_calendar", "patch_event", "delete_event"})
+
+# Entries are stamped with the process and its event cache generation, other processes' changes are only bounded by the TTL
+_PROCESS = uuid.uuid4().hex[:12]
+
+def completion_key(model: str, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema], tool_choice: Any, json_output: Any, extra_create_args: Mapping[str, Any]) -> str:
+    # Stable across processes: canonical JSON of everything that decides the completion, the messages exactly as sent
+    payload = {
+        "model": model,
+        "messages": [message.model_dump(mode="json") for message in messages],
+        "tools": [tool if isinstance(tool, dict) else tool.schema for tool in tools],
+        "tool_choice": tool_choice if isinstance(tool_choice, str) else getattr(tool_choice, "name", repr(tool_choice)),
+        "json_output": json_output if json_output is None or isinstance(json_output, bool) else repr(json_output),
+        "extra_create_args": dict(extra_create_args),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode()).hexdigest()
+
+def prior_turn_mutated(messages: Sequence[LLMMessage]) -> bool:
+    # Calendar changes in the previous turn or so far in the current one
+    users = 0
+    for message in reversed(messages):
+        if isinstance(message, UserMessage):
+            users += 1
+            if users == 2:
+                break
+        elif isinstance(message, AssistantMessage) and not isinstance(message.content, str):
+            if any(call.name in MUTATING_TOOLS for call in message.content):
+                return True
+    return False
+
+def calls_mutating_tool(result: CreateResult) -> bool:
+    # Replaying such a result would change the calendar again
+    return not isinstance(result.content, str) and any(call.name in MUTATING_TOOLS for call in result.content)
+
+class MemoryCompletionCache:
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, Tuple[float, str, str]] = OrderedDict()
+
+    async def get(self, key: str) -> Tuple[str, str] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored, stamp, value = entry
+        if time.time() - stored > self._ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return stamp, value
+
+    async def put(self, key: str, stamp: str, value: str) -> None:
+        self._entries[key] = (time.time(), stamp, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+class DiskCompletionCache:
+    """sqlite3 file shared by restarts (and processes), entries are evicted by TTL and least recent use."""
+
+    def __init__(self, path: str, ttl: float, max_entries: int) -> None:
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completion (key TEXT PRIMARY KEY, stamp TEXT, value TEXT, stored REAL, used REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_completion_used ON completion (used)")
+
+    async def get(self, key: str) -> Tuple[str, str] | None:
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key: str, stamp: str, value: str) -> None:
+        await asyncio.to_thread(self._put, key, stamp, value)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _get(self, key: str) -> Tuple[str, str] | None:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT stamp, value FROM completion WHERE key = ? AND stored > ?", (key, now - self._ttl)
+            ).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE completion SET used = ? WHERE key = ?", (now, key))
+        return row
+
+    def _put(self, key: str, stamp: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO completion VALUES (?, ?, ?, ?, ?)", (key, stamp, value, now, now))
+            self._connection.execute("DELETE FROM completion WHERE stored <= ?", (now - self._ttl,))
+            self._connection.execute(
+                "DELETE FROM completion WHERE key IN (SELECT key FROM completion ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,),
+            )
+
+class CachedChatCompletionClient(ChatCompletionClient):
+    """Answers a request identical to an earlier one (messages, tools and parameters) from a completion cache.
+
+    A cached result is only used while the calendar has not been changed through
+    this process since it was stored, and never when the previous turn changed
+    the calendar.
+    """
+
+    def __init__(self, client: ChatCompletionClient, cache: MemoryCompletionCache | DiskCompletionCache, model: str) -> None:
+        self._client = client
+        self._cache = cache
+        self._model = model
+        self._events_cache = EventCache().calendar(SETTINGS.calendar_id)
+        self._metrics = Metrics()
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Any = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: CancellationToken | None = None,
+    ) -> CreateResult:
+        key, result = await self._lookup(messages, tools, tool_choice, json_output, extra_create_args)
+        if result is not None:
+            return result
+        generation = self._events_cache.generation
+        result = await self._client.create(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+        )
+        await self._store(key, generation, result)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Any = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: CancellationToken | None = None,
+    ) -> AsyncGenerator[str | CreateResult, None]:
+        key, result = await self._lookup(messages, tools, tool_choice, json_output, extra_create_args)
+        if result is not None:
+            # Replayed as a single chunk
+            if isinstance(result.content, str):
+                yield result.content
+            yield result
+            return
+        generation = self._events_cache.generation
+        async for chunk in self._client.create_stream(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+        ):
+            if isinstance(chunk, CreateResult):
+                await self._store(key, generation, chunk)
+            yield chunk
+
+    async def _lookup(self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema], tool_choice: Any, json_output: Any, extra_create_args: Mapping[str, Any]) -> Tuple[str, CreateResult | None]:
+        key = completion_key(self._model, messages, tools, tool_choice, json_output, extra_create_args)
+        if prior_turn_mutated(messages):
+            self._count("bypass")
+            return key, None
+        entry = await self._cache.get(key)
+        result = CreateResult.model_validate_json(entry[1]) if entry is not None and self._fresh(entry[0]) else None
+        if result is None or calls_mutating_tool(result):
+            self._count("miss")
+            return key, None
+        self._count("hit")
+        # Nothing was sent to the model
+        return key, result.model_copy(update={"cached": True, "usage": RequestUsage(prompt_tokens=0, completion_tokens=0)})
+
+    async def _store(self, key: str, generation: int, result: CreateResult) -> None:
+        # Results that came back while the calendar changed may already be stale
+        if generation == self._events_cache.generation and result.finish_reason in ("stop", "function_calls") and not calls_mutating_tool(result):
+            await self._cache.put(key, f"{_PROCESS}:{generation}", result.model_dump_json())
+
+    def _fresh(self, stamp: str) -> bool:
+        process, _, generation = stamp.partition(":")
+        return process != _PROCESS or generation == str(self._events_cache.generation)
+
+    def _count(self, outcome: str) -> None:
+        self._metrics.inc("calendar_agent_completion_cache_total", help="Completion cache lookups, by outcome.", outcome=outcome)
+
+    async def close(self) -> None:
+        await self._cache.close()
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
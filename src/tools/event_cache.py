@@ -0,0 +1,167 @@
+from datetime import date, datetime, time as dt_time
+from bisect import bisect_left, insort
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+import asyncio
+from zoneinfo import ZoneInfo
+import time
+import tzlocal
+from src.config import SETTINGS
+from src.singleton import SingletonMeta
+
+Event = Dict[str, Any]
+
+def parse_datetime(value: str, time_zone: str | None = None) -> datetime:
+    # Accepts RFC 3339 date-times and all-day dates, naive values are read in `time_zone` (or the local zone)
+    if len(value) == 10:
+        parsed = datetime.combine(date.fromisoformat(value), dt_time.min)
+    else:
+        parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=ZoneInfo(time_zone) if time_zone else tzlocal.get_localzone())
+    return parsed
+
+def event_bounds(event: Event) -> Tuple[datetime, datetime]:
+    start, end = event.get("start", {}), event.get("end", {})
+    return (
+        parse_datetime(start.get("dateTime") or start["date"], start.get("timeZone")),
+        parse_datetime(end.get("dateTime") or end["date"], end.get("timeZone") or start.get("timeZone")),
+    )
+
+class CalendarEventCache:
+    """Events of a single calendar for the time ranges that have already been listed.
+
+    `_coverage` holds the merged, sorted ranges known to be complete and
+    `_starts` is a sorted (start, event id) index used to answer range queries.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self._ttl = ttl
+        self._coverage: List[Tuple[datetime, datetime, float]] = []
+        self._events: Dict[str, Event] = {}
+        self._bounds: Dict[str, Tuple[datetime, datetime]] = {}
+        self._starts: List[Tuple[datetime, str]] = []
+        self._max_duration = None
+        # Bumped by every local change, listings started before a change are not stored
+        self.generation = 0
+        # Listings currently being fetched, shared by identical concurrent requests
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    async def single_flight(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded so one cancelled caller doesn't cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    def in_flight_covering(self, time_min: datetime, time_max: datetime) -> asyncio.Task | None:
+        # A listing of a wider range, keyed by its (start, end), that will also answer this range
+        for key, task in self._in_flight.items():
+            if isinstance(key, tuple) and len(key) == 2 and key[0] <= time_min and time_max <= key[1]:
+                return task
+        return None
+
+    def query(self, time_min: datetime, time_max: datetime) -> List[Event] | None:
+        # Return None when the range is not fully covered by fresh listings
+        if not self._covers(time_min, time_max):
+            return None
+        # Only events starting within the longest event duration before time_min can overlap the range
+        lower = time_min - self._max_duration if self._max_duration else time_min
+        index = bisect_left(self._starts, (lower, ""))
+        events = []
+        for start, event_id in self._starts[index:]:
+            if start >= time_max:
+                break
+            if self._bounds[event_id][1] > time_min:
+                events.append(self._events[event_id])
+        return events
+
+    def store(self, time_min: datetime, time_max: datetime, events: List[Event], generation: int) -> None:
+        if generation != self.generation:
+            return
+        # The listing is authoritative for the range, replace whatever was cached there
+        for start, event_id in list(self._starts):
+            if start < time_max and self._bounds[event_id][1] > time_min:
+                self._discard(event_id)
+        for event in events:
+            self._insert(event)
+        self._add_coverage(time_min, time_max)
+
+    def upsert(self, event: Event) -> None:
+        self.generation += 1
+        # Recurring series expand into instances we can't rebuild locally, drop everything
+        if event.get("recurrence"):
+            self.clear()
+            return
+        self._discard(event["id"])
+        if event.get("status") != "cancelled":
+            self._insert(event)
+
+    def remove(self, event_id: str) -> None:
+        self.generation += 1
+        self._discard(event_id)
+        # Deleting a series also deletes its instances
+        for instance_id in [key for key, event in self._events.items() if event.get("recurringEventId") == event_id]:
+            self._discard(instance_id)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._coverage.clear()
+        self._events.clear()
+        self._bounds.clear()
+        self._starts.clear()
+        self._max_duration = None
+
+    def _insert(self, event: Event) -> None:
+        try:
+            start, end = event_bounds(event)
+        except (KeyError, ValueError):
+            return
+        self._events[event["id"]] = event
+        self._bounds[event["id"]] = (start, end)
+        insort(self._starts, (start, event["id"]))
+        if self._max_duration is None or end - start > self._max_duration:
+            self._max_duration = end - start
+
+    def _discard(self, event_id: str) -> None:
+        if event_id not in self._events:
+            return
+        start, _ = self._bounds.pop(event_id)
+        del self._events[event_id]
+        self._starts.remove((start, event_id))
+
+    def _covers(self, time_min: datetime, time_max: datetime) -> bool:
+        deadline = time.monotonic() - self._ttl
+        if any(loaded_at < deadline for _, _, loaded_at in self._coverage):
+            # Stale listings can't be trusted any more, neither can the events they loaded
+            self.clear()
+            return False
+        return any(start <= time_min and time_max <= end for start, end, _ in self._coverage)
+
+    def _add_coverage(self, time_min: datetime, time_max: datetime) -> None:
+        merged = []
+        start, end, loaded_at = time_min, time_max, time.monotonic()
+        for range_start, range_end, range_loaded_at in self._coverage:
+            if range_end < start or range_start > end:
+                merged.append((range_start, range_end, range_loaded_at))
+            else:
+                # Overlapping ranges merge, the merged range is as old as its oldest part
+                start, end = min(start, range_start), max(end, range_end)
+                loaded_at = min(loaded_at, range_loaded_at)
+        merged.append((start, end, loaded_at))
+        self._coverage = sorted(merged)
+
+class EventCache(metaclass=SingletonMeta):
+    """Process wide read-through event caches, one per calendar id."""
+
+    def __init__(self) -> None:
+        self._calendars: Dict[str, CalendarEventCache] = {}
+
+    def calendar(self, calendar_id: str) -> CalendarEventCache:
+        cache = self._calendars.get(calendar_id)
+        if cache is None:
+            cache = self._calendars[calendar_id] = CalendarEventCache(SETTINGS.event_cache_ttl_seconds)
+        return cache
+
+    def clear(self) -> None:
+        self._calendars.clear()
@@ -0,0 +1,92 @@
+from datetime import datetime, time, timedelta, timezone, tzinfo
+from dateutil.rrule import rrulestr
+from typing import Iterable, List, Sequence, Tuple
+from zoneinfo import ZoneInfo
+import re
+from src.tools.event_cache import Event, event_bounds
+
+Interval = Tuple[datetime, datetime]
+
+# A date or a date-time without a zone, what Google accepts as UNTIL besides UTC
+_LOCAL_UNTIL = re.compile(r"UNTIL=(\d{8})(?:T(\d{6}))?(?![\dTZ])")
+
+def blocks_time(event: Event) -> bool:
+    # Free ("transparent") and cancelled events don't make the user busy
+    return event.get("transparency") != "transparent" and event.get("status") != "cancelled"
+
+def expand_occurrences(start: datetime, end: datetime, recurrence: Sequence[str] | None, until: datetime, limit: int) -> List[Interval]:
+    # Expand RRULE/RDATE/EXDATE lines into concrete occurrences up to `until`
+    if not recurrence:
+        return [(start, end)]
+    # dateutil wants UNTIL in UTC once DTSTART is aware
+    rules = rrulestr("\n".join(_until_in_utc(line, start.tzinfo) for line in recurrence), dtstart=start, forceset=True)
+    duration = end - start
+    occurrences = []
+    for occurrence in rules.xafter(start, count=limit, inc=True):
+        if occurrence > until:
+            break
+        occurrences.append((occurrence, occurrence + duration))
+    return occurrences
+
+def _until_in_utc(line: str, time_zone: tzinfo) -> str:
+    # Read in the event's time zone, a date covers the whole day
+    def to_utc(match: re.Match) -> str:
+        until = datetime.strptime(match.group(1) + (match.group(2) or "235959"), "%Y%m%d%H%M%S").replace(tzinfo=time_zone)
+        return "UNTIL=" + until.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return _LOCAL_UNTIL.sub(to_utc, line)
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def find_overlaps(candidates: Sequence[Interval], events: Sequence[Event]) -> List[Tuple[Interval, Event]]:
+    # Sweep both start-sorted lists once, only events still running at a candidate's start can overlap it
+    busy = sorted(((event_bounds(event), event) for event in events if blocks_time(event)), key=lambda item: item[0])
+    overlaps = []
+    first = 0
+    for candidate_start, candidate_end in sorted(candidates):
+        while first < len(busy) and busy[first][0][1] <= candidate_start:
+            first += 1
+        for (event_start, event_end), event in busy[first:]:
+            if event_start >= candidate_end:
+                break
+            if event_end > candidate_start:
+                overlaps.append(((candidate_start, candidate_end), event))
+    return overlaps
+
+def working_windows(time_min: datetime, time_max: datetime, time_zone: ZoneInfo, day_start: time, day_end: time, working_days: Sequence[int]) -> List[Interval]:
+    windows = []
+    day = time_min.astimezone(time_zone).date()
+    while day <= time_max.astimezone(time_zone).date():
+        if day.weekday() in working_days:
+            start = max(time_min, datetime.combine(day, day_start, time_zone))
+            end = min(time_max, datetime.combine(day, day_end, time_zone))
+            if start < end:
+                windows.append((start, end))
+        day += timedelta(days=1)
+    return windows
+
+def free_slots(windows: Sequence[Interval], events: Sequence[Event], duration: timedelta) -> List[Interval]:
+    # Subtract the merged busy time from each window and keep gaps long enough for the meeting
+    busy = merge_intervals(event_bounds(event) for event in events if blocks_time(event))
+    slots = []
+    index = 0
+    for window_start, window_end in windows:
+        cursor = window_start
+        while index < len(busy) and busy[index][1] <= window_start:
+            index += 1
+        position = index
+        while position < len(busy) and busy[position][0] < window_end:
+            busy_start, busy_end = busy[position]
+            if busy_start - cursor >= duration:
+                slots.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            position += 1
+        if window_end - cursor >= duration:
+            slots.append((cursor, window_end))
+    return slots
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Literal
 from pydantic import BaseModel, Field
 import uuid
 from uuid import UUID
@@ -13,6 +13,7 @@ class UserData(BaseModel):
     username: str
     email: str
     token: str | None
+    timezone: str | None = None
 
 class EventDateTime(BaseModel):
     dateTime: str = Field(..., description="Event datetime string in ISO 8601 format")
@@ -24,4 +25,12 @@ class CalendarEvent(BaseModel):
     description: str | None = Field(None, description="Description of the event")
     start: EventDateTime
     end: EventDateTime 
-    recurrence: List[str] | None = Field(None, description=("Recurrence rules (RRULE)"))
\ No newline at end of file
+    recurrence: List[str] | None = Field(None, description=("Recurrence rules (RRULE)"))
+
+class StreamFrame(BaseModel):
+    type: Literal["session", "token", "tool", "done", "error"] = Field(..., description="Kind of frame")
+    content: str | None = Field(None, description="Token text, progress text or final reply")
+    name: str | None = Field(None, description="Tool name of a tool frame")
+    status: Literal["started", "finished", "failed"] | None = Field(None, description="Tool progress")
+    conversation_id: str | None = Field(None, description="Conversation of a session frame")
+    resume_token: str | None = Field(None, description="Token to pass back with the conversation id when reconnecting")
@@ -0,0 +1,55 @@
+from datetime import datetime
+from typing import List
+from src.tools.event_cache import Event, event_bounds
+
+def estimate_tokens(text: str) -> int:
+    # Rough estimate (~4 characters per token), good enough to keep tool results under a budget
+    return len(text) // 4 + 1
+
+def format_range(start: datetime, end: datetime) -> str:
+    offset = start.isoformat()[-6:] if start.tzinfo else ""
+    if start.date() == end.date():
+        text = f"{start:%Y-%m-%d %H:%M}-{end:%H:%M}"
+    else:
+        text = f"{start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}"
+    return f"{text} ({offset})" if offset else text
+
+def format_event(event: Event) -> str:
+    # One line with only what the agent needs: id | when | title [| where] [| flags]
+    if "date" in event.get("start", {}):
+        when = f"{event['start']['date']} (all day)"
+    else:
+        when = format_range(*event_bounds(event))
+    parts = [event.get("id", "?"), when, event.get("summary", "(no title)")]
+    if event.get("location"):
+        parts.append(f"at {event['location']}")
+    if event.get("recurrence"):
+        parts.append("recurrence=" + ";".join(event["recurrence"]))
+    if event.get("recurringEventId"):
+        parts.append(f"series={event['recurringEventId']}")
+    if event.get("status") not in (None, "confirmed"):
+        parts.append(event["status"])
+    return " | ".join(parts)
+
+def format_events(events: List[Event], offset: int, page_size: int, token_budget: int) -> str:
+    if not events:
+        return "No events found in this time range."
+    total = len(events)
+    header = "Events (id | when | title):"
+    lines = [header]
+    used = estimate_tokens(header)
+    for event in events[offset:offset + page_size]:
+        line = format_event(event)
+        cost = estimate_tokens(line)
+        # Always show at least one event so paging makes progress
+        if used + cost > token_budget and len(lines) > 1:
+            break
+        lines.append(line)
+        used += cost
+    shown = len(lines) - 1
+    if offset + shown < total:
+        lines.append(f"Showing {offset + 1}-{offset + shown} of {total}, call again with offset={offset + shown} for more.")
+    return "\n".join(lines)
+
+def format_mutation(action: str, event: Event) -> str:
+    return f"{action}: {format_event(event)}"
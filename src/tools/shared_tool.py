@@ -0,0 +1,39 @@
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseTool, FunctionTool, ToolSchema
+from pydantic import BaseModel
+from typing import Any, Callable, List, Type
+import inspect
+
+class ToolSpec:
+    """Argument model and JSON schema of a tool, built once and shared by every agent."""
+
+    def __init__(self, func: Callable[..., Any], description: str) -> None:
+        # FunctionTool does the signature introspection, its schema is generated here and never again
+        tool = FunctionTool(func, description=description)
+        self.name = tool.name
+        self.description = tool.description
+        self.args_type: Type[BaseModel] = tool.args_type()
+        self.return_type: Type[Any] = tool.return_type()
+        self.schema: ToolSchema = tool.schema
+        self.parameters: List[str] = list(self.args_type.model_fields)
+        self.is_async = inspect.iscoroutinefunction(func)
+
+class SharedTool(BaseTool[BaseModel, Any]):
+    """Binds a ToolSpec to the method of one client, like a FunctionTool without rebuilding the schema."""
+
+    def __init__(self, spec: ToolSpec, func: Callable[..., Any]) -> None:
+        super().__init__(spec.args_type, spec.return_type, spec.name, spec.description)
+        self._spec = spec
+        self._func = func
+
+    @property
+    def schema(self) -> ToolSchema:
+        return self._spec.schema
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> Any:
+        # Keep nested pydantic models as they are, the tool functions expect them
+        kwargs = {name: getattr(args, name) for name in self._spec.parameters}
+        if self._spec.is_async:
+            return await self._func(**kwargs)
+        # The only sync tools are cheap and do no I/O
+        return self._func(**kwargs)
@@ -0,0 +1,10 @@
+"""Shared setup of the unit tests, run them from the repository root with `python -m pytest tests`."""
+from pathlib import Path
+import os
+import tempfile
+
+# Settings are read on import, so defaults for an offline run go in first
+_workdir = tempfile.mkdtemp(prefix="calendar-tests-")
+os.environ.setdefault("MY_OPENAI_API_KEY", "offline")
+os.environ.setdefault("MY_CALENDAR_ID", "tests@calendar.local")
+os.environ.setdefault("MY_DATABASE_URL", f"sqlite+aiosqlite:///{Path(_workdir) / 'tests.sqlite'}")
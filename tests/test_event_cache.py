@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+from src.tools.event_cache import CalendarEventCache, parse_datetime
+
+DAY = datetime(2026, 3, 2, tzinfo=timezone.utc)
+
+def _event(event_id, start_hour, hours=1, **fields):
+    start = DAY + timedelta(hours=start_hour)
+    return {
+        "id": event_id,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": (start + timedelta(hours=hours)).isoformat()},
+        **fields,
+    }
+
+def _ids(events):
+    return sorted(event["id"] for event in events)
+
+def test_parse_datetime_reads_naive_values_in_the_given_zone():
+    assert parse_datetime("2026-03-02T09:00:00", "Europe/Paris").utcoffset() == timedelta(hours=1)
+    assert parse_datetime("2026-03-02") == parse_datetime("2026-03-02T00:00:00")
+    assert parse_datetime("2026-03-02T09:00:00Z").tzinfo is not None
+
+def test_query_answers_only_covered_ranges():
+    cache = CalendarEventCache(ttl=60)
+    assert cache.query(DAY, DAY + timedelta(days=1)) is None
+    cache.store(DAY, DAY + timedelta(days=1), [_event("a", 9), _event("b", 14)], cache.generation)
+    assert _ids(cache.query(DAY, DAY + timedelta(days=1))) == ["a", "b"]
+    assert _ids(cache.query(DAY + timedelta(hours=12), DAY + timedelta(hours=18))) == ["b"]
+    assert cache.query(DAY, DAY + timedelta(days=2)) is None
+
+def test_overlapping_and_touching_listings_merge_their_coverage():
+    cache = CalendarEventCache(ttl=60)
+    cache.store(DAY, DAY + timedelta(hours=12), [_event("a", 9)], cache.generation)
+    cache.store(DAY + timedelta(hours=12), DAY + timedelta(days=1), [_event("b", 14)], cache.generation)
+    cache.store(DAY + timedelta(days=3), DAY + timedelta(days=4), [], cache.generation)
+    assert [(start, end) for start, end, _ in cache._coverage] == [
+        (DAY, DAY + timedelta(days=1)),
+        (DAY + timedelta(days=3), DAY + timedelta(days=4)),
+    ]
+    assert _ids(cache.query(DAY + timedelta(hours=8), DAY + timedelta(hours=16))) == ["a", "b"]
+    assert cache.query(DAY, DAY + timedelta(days=4)) is None
+
+def test_query_finds_long_events_that_started_before_the_range():
+    cache = CalendarEventCache(ttl=60)
+    cache.store(DAY - timedelta(days=1), DAY + timedelta(days=1), [_event("conference", -20, hours=30), _event("a", 9)], cache.generation)
+    assert _ids(cache.query(DAY + timedelta(hours=8), DAY + timedelta(hours=12))) == ["a", "conference"]
+    assert _ids(cache.query(DAY + timedelta(hours=12), DAY + timedelta(hours=13))) == []
+
+def test_a_listing_replaces_what_was_cached_in_its_range():
+    cache = CalendarEventCache(ttl=60)
+    cache.store(DAY, DAY + timedelta(days=1), [_event("a", 9), _event("b", 14)], cache.generation)
+    cache.store(DAY, DAY + timedelta(days=1), [_event("b", 15)], cache.generation)
+    events = cache.query(DAY, DAY + timedelta(days=1))
+    assert _ids(events) == ["b"]
+    assert events[0]["start"]["dateTime"] == (DAY + timedelta(hours=15)).isoformat()
+
+def test_listings_started_before_a_local_change_are_not_stored():
+    cache = CalendarEventCache(ttl=60)
+    generation = cache.generation
+    cache.upsert(_event("new", 10))
+    cache.store(DAY, DAY + timedelta(days=1), [_event("a", 9)], generation)
+    assert cache.query(DAY, DAY + timedelta(days=1)) is None
+    cache.store(DAY, DAY + timedelta(days=1), [_event("a", 9), _event("new", 10)], cache.generation)
+    assert _ids(cache.query(DAY, DAY + timedelta(days=1))) == ["a", "new"]
+
+def test_local_changes_update_the_cached_events():
+    cache = CalendarEventCache(ttl=60)
+    cache.store(DAY, DAY + timedelta(days=1), [_event("a", 9), _event("b", 14)], cache.generation)
+    cache.upsert(_event("a", 11))
+    cache.upsert(_event("b", 14, status="cancelled"))
+    cache.upsert(_event("c", 16))
+    assert _ids(cache.query(DAY, DAY + timedelta(days=1))) == ["a", "c"]
+    assert _ids(cache.query(DAY + timedelta(hours=9), DAY + timedelta(hours=10))) == []
+    cache.remove("c")
+    assert _ids(cache.query(DAY, DAY + timedelta(days=1))) == ["a"]
+
+def test_removing_a_series_removes_its_instances():
+    cache = CalendarEventCache(ttl=60)
+    instances = [_event(f"series_{hour}", hour, recurringEventId="series") for hour in (9, 10, 11)]
+    cache.store(DAY, DAY + timedelta(days=1), instances + [_event("a", 14)], cache.generation)
+    cache.remove("series")
+    assert _ids(cache.query(DAY, DAY + timedelta(days=1))) == ["a"]
+
+def test_upserting_a_recurring_event_drops_the_coverage():
+    cache = CalendarEventCache(ttl=60)
+    cache.store(DAY, DAY + timedelta(days=1), [_event("a", 9)], cache.generation)
+    cache.upsert(_event("weekly", 10, recurrence=["RRULE:FREQ=WEEKLY"]))
+    assert cache.query(DAY, DAY + timedelta(days=1)) is None
+
+def test_expired_listings_are_not_trusted():
+    cache = CalendarEventCache(ttl=0)
+    cache.store(DAY, DAY + timedelta(days=1), [_event("a", 9)], cache.generation)
+    assert cache.query(DAY, DAY + timedelta(hours=1)) is None
+    assert cache._events == {}
+
+def test_single_flight_shares_one_fetch_between_concurrent_callers():
+    async def main():
+        cache = CalendarEventCache(ttl=60)
+        calls = 0
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return [_event("a", 9)]
+        key = (DAY, DAY + timedelta(days=1))
+        first = asyncio.create_task(cache.single_flight(key, fetch))
+        await asyncio.sleep(0)
+        assert cache.in_flight_covering(DAY + timedelta(hours=1), DAY + timedelta(hours=2)) is not None
+        assert cache.in_flight_covering(DAY, DAY + timedelta(days=2)) is None
+        results = await asyncio.gather(first, cache.single_flight(key, fetch))
+        assert calls == 1
+        assert results[0] is results[1]
+        assert cache._in_flight == {}
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+import pytest
+from src.tools.free_busy import blocks_time, expand_occurrences, find_overlaps, free_slots, merge_intervals, working_windows
+
+PARIS = ZoneInfo("Europe/Paris")
+# A Monday
+MONDAY = datetime(2026, 3, 2, tzinfo=PARIS)
+
+def _at(day, hour, minute=0):
+    return MONDAY + timedelta(days=day, hours=hour, minutes=minute)
+
+def _event(event_id, start, end, **fields):
+    return {"id": event_id, "start": {"dateTime": start.isoformat()}, "end": {"dateTime": end.isoformat()}, **fields}
+
+def test_a_single_event_has_one_occurrence():
+    assert expand_occurrences(_at(0, 9), _at(0, 10), None, _at(30, 0), 100) == [(_at(0, 9), _at(0, 10))]
+
+def test_expands_a_daily_rule_up_to_until_and_limit():
+    occurrences = expand_occurrences(_at(0, 9), _at(0, 10), ["RRULE:FREQ=DAILY"], _at(4, 12), 100)
+    assert [start for start, _ in occurrences] == [_at(day, 9) for day in range(5)]
+    assert all(end - start == timedelta(hours=1) for start, end in occurrences)
+    assert len(expand_occurrences(_at(0, 9), _at(0, 10), ["RRULE:FREQ=DAILY"], _at(30, 0), 3)) == 3
+
+@pytest.mark.parametrize("until", ["20260304", "20260304T235959", "20260304T220000Z"])
+def test_accepts_every_form_of_until(until):
+    occurrences = expand_occurrences(_at(0, 9), _at(0, 10), [f"RRULE:FREQ=DAILY;UNTIL={until}"], _at(30, 0), 100)
+    assert [start for start, _ in occurrences] == [_at(day, 9) for day in range(3)]
+
+def test_exdate_removes_an_occurrence():
+    recurrence = ["RRULE:FREQ=DAILY;COUNT=3", "EXDATE:20260303T080000Z"]
+    occurrences = expand_occurrences(_at(0, 9), _at(0, 10), recurrence, _at(30, 0), 100)
+    assert [start for start, _ in occurrences] == [_at(0, 9), _at(2, 9)]
+
+def test_merge_intervals_joins_overlapping_and_touching_ones():
+    intervals = [(_at(0, 13), _at(0, 14)), (_at(0, 9), _at(0, 10)), (_at(0, 10), _at(0, 11)), (_at(0, 13, 30), _at(0, 13, 45))]
+    assert merge_intervals(intervals) == [(_at(0, 9), _at(0, 11)), (_at(0, 13), _at(0, 14))]
+
+def test_free_and_cancelled_events_do_not_block_time():
+    assert blocks_time(_event("a", _at(0, 9), _at(0, 10)))
+    assert not blocks_time(_event("b", _at(0, 9), _at(0, 10), transparency="transparent"))
+    assert not blocks_time(_event("c", _at(0, 9), _at(0, 10), status="cancelled"))
+
+def test_find_overlaps_pairs_each_candidate_with_the_events_it_hits():
+    events = [
+        _event("long", _at(0, 8), _at(0, 12)),
+        _event("lunch", _at(0, 12), _at(0, 13)),
+        _event("free", _at(0, 9), _at(0, 10), transparency="transparent"),
+    ]
+    candidates = [(_at(0, 9), _at(0, 10)), (_at(0, 11, 30), _at(0, 12, 30)), (_at(0, 13), _at(0, 14))]
+    overlaps = [(candidate, event["id"]) for candidate, event in find_overlaps(candidates, events)]
+    assert overlaps == [
+        ((_at(0, 9), _at(0, 10)), "long"),
+        ((_at(0, 11, 30), _at(0, 12, 30)), "long"),
+        ((_at(0, 11, 30), _at(0, 12, 30)), "lunch"),
+    ]
+
+def test_working_windows_skip_weekends_and_clip_to_the_range():
+    windows = working_windows(_at(4, 10), _at(7, 12), PARIS, time(9), time(17), range(5))
+    assert windows == [(_at(4, 10), _at(4, 17)), (_at(7, 9), _at(7, 12))]
+
+def test_working_windows_are_in_the_given_zone():
+    windows = working_windows(datetime(2026, 3, 2, tzinfo=timezone.utc), datetime(2026, 3, 3, tzinfo=timezone.utc), ZoneInfo("America/New_York"), time(9), time(17), range(5))
+    assert windows == [(datetime(2026, 3, 2, 14, tzinfo=timezone.utc), datetime(2026, 3, 2, 22, tzinfo=timezone.utc))]
+
+def test_free_slots_are_the_long_enough_gaps_between_busy_time():
+    windows = [(_at(0, 9), _at(0, 17)), (_at(1, 9), _at(1, 17))]
+    events = [
+        _event("a", _at(0, 9, 30), _at(0, 11)),
+        _event("b", _at(0, 10, 30), _at(0, 12)),
+        _event("c", _at(0, 12, 15), _at(0, 16)),
+        _event("d", _at(1, 8), _at(1, 10)),
+        _event("free", _at(1, 10), _at(1, 17), transparency="transparent"),
+    ]
+    assert free_slots(windows, events, timedelta(minutes=30)) == [
+        (_at(0, 9), _at(0, 9, 30)),
+        (_at(0, 16), _at(0, 17)),
+        (_at(1, 10), _at(1, 17)),
+    ]
@@ -0,0 +1,44 @@
+from uuid import uuid4
+import time
+import pytest
+from src.config import SETTINGS
+from src.resume import check_resume_secret, issue_resume_token, verify_resume_token
+
+def test_a_token_resumes_only_its_users_conversation():
+    user_id, conversation_id = uuid4(), uuid4()
+    token = issue_resume_token(user_id, conversation_id)
+    assert verify_resume_token(token, user_id, conversation_id)
+    assert not verify_resume_token(token, uuid4(), conversation_id)
+    assert not verify_resume_token(token, user_id, uuid4())
+
+def test_tampered_and_missing_tokens_are_rejected():
+    user_id, conversation_id = uuid4(), uuid4()
+    expires, _, signature = issue_resume_token(user_id, conversation_id).partition(".")
+    assert not verify_resume_token(f"{int(expires) + 3600}.{signature}", user_id, conversation_id)
+    assert not verify_resume_token(f"{expires}.{signature[:-1]}", user_id, conversation_id)
+    assert not verify_resume_token(f"soon.{signature}", user_id, conversation_id)
+    assert not verify_resume_token(None, user_id, conversation_id)
+    assert not verify_resume_token("", user_id, conversation_id)
+
+def test_expired_tokens_are_rejected(monkeypatch):
+    user_id, conversation_id = uuid4(), uuid4()
+    token = issue_resume_token(user_id, conversation_id)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + SETTINGS.resume_token_ttl_seconds + 1)
+    assert not verify_resume_token(token, user_id, conversation_id)
+
+@pytest.mark.parametrize("runtime_mode, workers", [("grpc", "1"), ("local", "4")])
+def test_several_processes_need_a_shared_secret(monkeypatch, runtime_mode, workers):
+    monkeypatch.setattr(SETTINGS, "runtime_mode", runtime_mode)
+    monkeypatch.setenv("WEB_CONCURRENCY", workers)
+    monkeypatch.setattr(SETTINGS, "resume_secret", "")
+    with pytest.raises(RuntimeError):
+        check_resume_secret()
+    monkeypatch.setattr(SETTINGS, "resume_secret", "shared")
+    check_resume_secret()
+
+def test_a_single_process_needs_no_secret(monkeypatch):
+    monkeypatch.setattr(SETTINGS, "runtime_mode", "local")
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    monkeypatch.setattr(SETTINGS, "resume_secret", "")
+    check_resume_secret()
@@ -0,0 +1,145 @@
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import asyncio
+import pytest
+from src import scheduler
+from src.config import SETTINGS
+from src.scheduler import BACKGROUND, INTERACTIVE, RequestScheduler, _Backend, backoff, classify
+
+class _Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+class _OpenAIError(Exception):
+    # Shaped like openai.APIStatusError
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = _Response(headers or {})
+
+class _Resp(dict):
+    # Shaped like the httplib2 response of googleapiclient's HttpError
+    def __init__(self, status, **headers):
+        super().__init__(headers)
+        self.status = status
+
+class _HttpError(Exception):
+    def __init__(self, status, reason, **headers):
+        super().__init__(reason)
+        self.resp = _Resp(status, **headers)
+
+class APIConnectionError(Exception):
+    pass
+
+def test_classify_rate_limits():
+    assert classify(_OpenAIError(429, {"retry-after": "3"})) == (True, True, 3.0)
+    assert classify(_OpenAIError(429, {"retry-after-ms": "250"})) == (True, True, 0.25)
+    assert classify(_HttpError(429, "Too Many Requests", **{"retry-after": "7"})) == (True, True, 7.0)
+    assert classify(_HttpError(403, "Rate Limit Exceeded: userRateLimitExceeded")) == (True, True, None)
+
+def test_classify_retry_after_as_an_http_date():
+    when = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    throttled, retryable, retry_after = classify(_OpenAIError(429, {"retry-after": when}))
+    assert throttled and retryable
+    assert 25 < retry_after <= 30
+    assert classify(_OpenAIError(429, {"retry-after": "soon"})) == (True, True, None)
+
+def test_classify_server_and_network_errors_as_retryable():
+    assert classify(_OpenAIError(503)) == (False, True, None)
+    assert classify(_HttpError(500, "Backend Error")) == (False, True, None)
+    assert classify(ConnectionResetError()) == (False, True, None)
+    assert classify(asyncio.TimeoutError()) == (False, True, None)
+    assert classify(APIConnectionError()) == (False, True, None)
+
+def test_classify_other_errors_as_final():
+    assert classify(_OpenAIError(400)) == (False, False, None)
+    assert classify(_HttpError(403, "Forbidden")) == (False, False, None)
+    assert classify(_HttpError(404, "Not Found")) == (False, False, None)
+    assert classify(ValueError("bad arguments")) == (False, False, None)
+
+def test_backoff_is_jittered_and_capped():
+    base, cap = SETTINGS.scheduler_backoff_base_seconds, SETTINGS.scheduler_backoff_max_seconds
+    for attempt in range(10):
+        assert 0 <= backoff(attempt, None) <= min(cap, base * 2 ** attempt)
+    assert 3 <= backoff(0, 3) <= 3 + base
+    assert cap <= backoff(0, cap * 10) <= cap + base
+
+def _no_sleep(monkeypatch):
+    monkeypatch.setattr(scheduler, "backoff", lambda attempt, retry_after: 0)
+    RequestScheduler.reset()
+    return RequestScheduler()
+
+def test_run_retries_throttled_calls_and_halves_the_limit(monkeypatch):
+    requests = _no_sleep(monkeypatch)
+    calls = 0
+    async def call():
+        nonlocal calls
+        calls += 1
+        if calls < 3:
+            raise _OpenAIError(429)
+        return "ok"
+    assert asyncio.run(requests.run("openai", call, idempotent=False)) == "ok"
+    assert calls == 3
+    backend = requests.backend("openai")
+    assert backend.limit < backend.max_limit / 2
+    assert backend.in_flight == 0
+
+def test_run_does_not_retry_server_errors_of_non_idempotent_calls(monkeypatch):
+    requests = _no_sleep(monkeypatch)
+    calls = 0
+    async def call():
+        nonlocal calls
+        calls += 1
+        raise _OpenAIError(500)
+    with pytest.raises(_OpenAIError):
+        asyncio.run(requests.run("calendar", call, idempotent=False))
+    assert calls == 1
+    calls = 0
+    with pytest.raises(_OpenAIError):
+        asyncio.run(requests.run("calendar", call))
+    assert calls == SETTINGS.scheduler_max_retries + 1
+
+def test_backend_limit_is_aimd():
+    backend = _Backend("openai")
+    backend.throttled()
+    assert backend.limit == backend.max_limit / 2
+    for _ in range(100):
+        backend.throttled()
+    assert backend.limit == 1
+    for _ in range(1000):
+        backend.succeeded()
+    assert backend.limit == backend.max_limit
+
+def test_waiting_requests_get_slots_interactive_first():
+    async def main():
+        backend = _Backend("calendar")
+        backend.limit = 1
+        await backend.acquire(INTERACTIVE)
+        order = []
+        async def waiter(name, priority):
+            await backend.acquire(priority)
+            order.append(name)
+            backend.release()
+        tasks = [asyncio.create_task(waiter("background", BACKGROUND)), asyncio.create_task(waiter("interactive", INTERACTIVE))]
+        await asyncio.sleep(0)
+        assert backend.queued == 2
+        backend.release()
+        await asyncio.gather(*tasks)
+        assert order == ["interactive", "background"]
+        assert backend.in_flight == 0
+    asyncio.run(main())
+
+def test_a_cancelled_waiter_does_not_leak_its_slot():
+    async def main():
+        backend = _Backend("calendar")
+        backend.limit = 1
+        await backend.acquire(INTERACTIVE)
+        waiter = asyncio.create_task(backend.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        # Handed the slot and cancelled before it could run
+        backend.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert backend.in_flight == 0
+    asyncio.run(main())
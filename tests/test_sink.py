@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+import asyncio
+import pytest
+from sqlmodel import SQLModel, select
+from src.database.db import Database
+from src.database.models import Conversation, Message, User
+from src.database.sink import MessageSink
+
+async def _setup():
+    # A fresh engine per event loop, with empty tables and one conversation
+    Database.reset()
+    MessageSink.reset()
+    database = Database()
+    async with database.engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.drop_all)
+        await connection.run_sync(SQLModel.metadata.create_all)
+    user = User(id=uuid4(), username="test", email="test@example.com", token=None)
+    conversation = Conversation(user_id=user.id, updated_at=datetime.now(timezone.utc) - timedelta(days=1))
+    await database.create_all([user, conversation])
+    return database, MessageSink(), conversation.id
+
+def _row(conversation_id, content):
+    return Message(conversation_id=conversation_id, content=content, source="user")
+
+async def _contents(database, conversation_id):
+    rows = await database.get_all(select(Message).where(Message.conversation_id == conversation_id).order_by(Message.id))
+    return [row.content for row in rows]
+
+def test_end_turn_writes_buffered_rows_and_touches_the_conversation():
+    async def main():
+        database, sink, conversation_id = await _setup()
+        await sink.add(conversation_id, _row(conversation_id, "a"))
+        await sink.add(conversation_id, _row(conversation_id, "b"))
+        assert sink.pending(conversation_id) == 2
+        assert await _contents(database, conversation_id) == []
+        await sink.end_turn(conversation_id)
+        assert sink.pending() == 0
+        assert await _contents(database, conversation_id) == ["a", "b"]
+        conversation = await database.get(select(Conversation).where(Conversation.id == conversation_id))
+        assert conversation.updated_at.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc) - timedelta(minutes=1)
+        await database.dispose()
+    asyncio.run(main())
+
+def test_flushes_early_once_max_buffered_rows_are_pending():
+    async def main():
+        database, sink, conversation_id = await _setup()
+        sink._max_buffered = 2
+        await sink.add(conversation_id, _row(conversation_id, "a"))
+        await sink.add(conversation_id, _row(conversation_id, "b"))
+        assert sink.pending(conversation_id) == 0
+        assert await _contents(database, conversation_id) == ["a", "b"]
+        await database.dispose()
+    asyncio.run(main())
+
+def test_flushes_after_the_flush_interval():
+    async def main():
+        database, sink, conversation_id = await _setup()
+        sink._flush_interval = 0.01
+        await sink.add(conversation_id, _row(conversation_id, "a"))
+        await asyncio.sleep(0.2)
+        assert sink.pending(conversation_id) == 0
+        assert await _contents(database, conversation_id) == ["a"]
+        await database.dispose()
+    asyncio.run(main())
+
+def test_failed_flush_keeps_rows_in_order_for_the_next_one():
+    async def main():
+        database, sink, conversation_id = await _setup()
+        create_all = database.create_all
+        async def failing(rows, statements=None):
+            database.create_all = create_all
+            raise ConnectionError("database unavailable")
+        database.create_all = failing
+        await sink.add(conversation_id, _row(conversation_id, "a"))
+        await sink.add(conversation_id, _row(conversation_id, "b"))
+        with pytest.raises(ConnectionError):
+            await sink.flush(conversation_id)
+        await sink.add(conversation_id, _row(conversation_id, "c"))
+        assert await sink.flush(conversation_id) == 3
+        assert await _contents(database, conversation_id) == ["a", "b", "c"]
+        await database.dispose()
+    asyncio.run(main())
+
+def test_async_durability_writes_in_the_background_and_drains():
+    async def main():
+        database, sink, conversation_id = await _setup()
+        sink.durability = "async"
+        await sink.add(conversation_id, _row(conversation_id, "a"))
+        await sink.end_turn(conversation_id)
+        await sink.add(conversation_id, _row(conversation_id, "b"))
+        await sink.drain()
+        assert sink.pending() == 0
+        assert await _contents(database, conversation_id) == ["a", "b"]
+        await database.dispose()
+    asyncio.run(main())
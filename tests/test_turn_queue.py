@@ -0,0 +1,90 @@
+from uuid import uuid4
+import asyncio
+import pytest
+from src.agents.turn_queue import TurnQueue
+from src.tools.messages import CustomMessage
+
+def _message(conversation_id, content):
+    return CustomMessage(user_id=uuid4(), conversation_id=conversation_id, content=content)
+
+def test_runs_one_turn_at_a_time_in_order():
+    async def main():
+        queue, conversation_id = TurnQueue(coalesce=False), uuid4()
+        running, seen = 0, []
+        async def run(message):
+            nonlocal running
+            running += 1
+            assert running == 1
+            await asyncio.sleep(0.01)
+            seen.append(message.content)
+            running -= 1
+            return _message(conversation_id, message.content.upper())
+        replies = await asyncio.gather(*(queue.submit(_message(conversation_id, text), run) for text in ("a", "b", "c")))
+        assert [reply.content for reply in replies] == ["A", "B", "C"]
+        assert seen == ["a", "b", "c"]
+        assert not queue.in_flight(conversation_id)
+    asyncio.run(main())
+
+def test_coalesces_messages_queued_behind_a_turn():
+    async def main():
+        queue, conversation_id = TurnQueue(coalesce=True), uuid4()
+        started = asyncio.Event()
+        seen = []
+        async def run(message):
+            seen.append(message.content)
+            started.set()
+            await asyncio.sleep(0.01)
+            return _message(conversation_id, f"reply {len(seen)}")
+        first = asyncio.create_task(queue.submit(_message(conversation_id, "a"), run))
+        await started.wait()
+        queued = [asyncio.create_task(queue.submit(_message(conversation_id, text), run)) for text in ("b", "c")]
+        replies = await asyncio.gather(first, *queued)
+        assert seen == ["a", "b\nc"]
+        assert [reply.content for reply in replies] == ["reply 1", "reply 2", "reply 2"]
+    asyncio.run(main())
+
+def test_failed_turn_fails_only_its_senders():
+    async def main():
+        queue, conversation_id = TurnQueue(coalesce=False), uuid4()
+        async def run(message):
+            if message.content == "bad":
+                raise ValueError("model error")
+            return message
+        bad = asyncio.create_task(queue.submit(_message(conversation_id, "bad"), run))
+        good = asyncio.create_task(queue.submit(_message(conversation_id, "good"), run))
+        with pytest.raises(ValueError):
+            await bad
+        assert (await good).content == "good"
+    asyncio.run(main())
+
+def test_cancelled_turn_does_not_strand_queued_senders():
+    async def main():
+        queue, conversation_id = TurnQueue(coalesce=False), uuid4()
+        async def run(message):
+            if message.content == "cancelled":
+                # What the sender's cancellation token does to the model call
+                raise asyncio.CancelledError()
+            return message
+        cancelled = asyncio.create_task(queue.submit(_message(conversation_id, "cancelled"), run))
+        next_turn = asyncio.create_task(queue.submit(_message(conversation_id, "next"), run))
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert (await asyncio.wait_for(next_turn, 1)).content == "next"
+        assert not queue.in_flight(conversation_id)
+    asyncio.run(main())
+
+def test_cancelling_the_driver_cancels_every_waiting_sender():
+    async def main():
+        queue, conversation_id = TurnQueue(coalesce=False), uuid4()
+        started = asyncio.Event()
+        async def run(message):
+            started.set()
+            await asyncio.sleep(10)
+            return message
+        senders = [asyncio.create_task(queue.submit(_message(conversation_id, text), run)) for text in ("a", "b")]
+        await started.wait()
+        queue._drivers[conversation_id].cancel()
+        results = await asyncio.wait_for(asyncio.gather(*senders, return_exceptions=True), 1)
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        assert not queue.in_flight(conversation_id)
+    asyncio.run(main())